@@ -0,0 +1,44 @@
+"""
+Helpers shared by the asset scripts that need nothing beyond the standard
+library: the province name a source file stands for, and putting a built
+file in place atomically.
+"""
+
+import os
+
+
+ProvinceName = str
+FilePath = str
+
+# Source names that differ from the province name used by ./map once
+# underscores are dropped, e.g. the hand-cleaned data/cln1/Inner.svg.
+PROVINCE_NAMES = {"Inner": "InnerMongolia"}
+
+
+def province_name(name: str) -> ProvinceName:
+    """
+    Returns the province a source file name stands for, as named in ./map:
+    everything before "_locator_map" without underscores, so both
+    Inner_Mongolia_locator_map_(China) and Inner become InnerMongolia.
+    """
+    province = name.split("_locator_map")[0].replace("_", "")
+    return PROVINCE_NAMES.get(province, province)
+
+
+def install_file(source: FilePath, destination: FilePath) -> None:
+    """
+    Puts source in place at destination without copying its contents: a
+    hard link is made under a temporary name and renamed over destination,
+    so readers see either the old or the new file. Falls back to a copy when
+    the two paths are on different file systems.
+    """
+    temp_destination = destination + ".tmp"
+    if os.path.lexists(temp_destination):
+        os.remove(temp_destination)
+    try:
+        os.link(source, temp_destination)
+    except OSError:
+        with open(source, "rb") as src, open(temp_destination, "wb") as dst:
+            while chunk := src.read(1 << 20):
+                dst.write(chunk)
+    os.replace(temp_destination, destination)
@@ -0,0 +1,573 @@
+"""
+Incremental build of the map assets: scrape -> ingest -> clean -> rasterize
+-> install, modelled as a dependency graph.
+
+Every step is a node with input files, output files and an action. A node is
+run only if the content hash of its inputs and arguments differs from the
+stamp recorded when it last ran, or if one of its outputs is missing or was
+changed since. File hashes are remembered by size and modification time, so
+checking an up-to-date tree only stats files. Because stamps hash contents
+and not times, a step that rewrites a file with the same bytes does not
+cause the steps after it to run.
+
+The store is split into one delta file per province after cleaning, so a
+change to one province's SVG re-rasterizes and reinstalls only that province.
+Nodes whose dependencies are done run in parallel on a process pool, and
+results are installed where the viewer reads them by hard link and atomic
+rename: the masks into ./map/masks and the background into ./map. The label
+raster and the asset bundle are rebuilt from the installed masks whenever
+one of them changes.
+
+    python build.py data/cln/*.svg data/cln1/*.svg
+    python build.py --scrape
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from asset_files import install_file
+from bundle import BUNDLE_FILENAME, build_bundle
+from clean_map_data import DEFAULT_REMOVED_CLASSES, filter_svg
+from labels import (
+    LABELS_FILENAME,
+    LABELS_INDEX_FILENAME,
+    build_label_raster,
+    save_label_raster,
+)
+from layers import BACKGROUND_FILENAME
+from rasterize import (
+    MASK_BACKGROUND_FILENAME,
+    MASKS_DIRECTORY,
+    MASKS_INDEX_FILENAME,
+    MaskLayers,
+    canvas_size,
+    mask_index,
+    rasterize_svg,
+    write_mask,
+)
+from render_cache import file_sha256
+from scrape_svg import DATA_DIRECTORY, LINKS, CachedFetcher, scrape, svg_filename
+from svgstore import (
+    BASE_FILENAME,
+    CLEANED_BASE_FILENAME,
+    CLEANED_DELTAS_FILENAME,
+    DELTAS_FILENAME,
+    STORE_DIRECTORY,
+    clean_store,
+    ingest,
+    load_deltas,
+    province_name,
+    save_deltas,
+)
+
+
+ProvinceName = str
+FilePath = str
+NodeName = str
+
+BUILD_DIRECTORY = "./data/build"
+STAMPS_FILENAME = "./data/build/stamps.json"
+# Bump when the actions change their output, so every node runs again.
+BUILD_VERSION = 1
+
+
+class Node:
+    """
+    One build step. action(*args) must read nothing but inputs and write
+    exactly outputs; deps are the nodes that produce its inputs. A node with
+    always set runs on every build, for steps whose real inputs cannot be
+    hashed, such as a download.
+    """
+
+    def __init__(
+        self,
+        name: NodeName,
+        action: Callable[..., Any],
+        args: Sequence[Any] = (),
+        inputs: Iterable[FilePath] = (),
+        outputs: Iterable[FilePath] = (),
+        deps: Iterable[NodeName] = (),
+        always: bool = False,
+    ):
+        self.name = name
+        self.action = action
+        self.args = tuple(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.always = always
+
+
+class Stamps:
+    """
+    The stamp of every node and the remembered hash of every file, kept in a
+    JSON file between builds.
+    """
+
+    def __init__(self, filename: FilePath = STAMPS_FILENAME):
+        self.filename = filename
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            data = {}
+        if data.get("version") != BUILD_VERSION:
+            data = {}
+        self.files: Dict[str, List[Any]] = data.get("files", {})
+        self.nodes: Dict[NodeName, Dict[str, Any]] = data.get("nodes", {})
+
+    def file_hash(self, filepath: FilePath) -> Optional[str]:
+        """
+        Returns the SHA-256 of a file, or None if it does not exist. The file
+        is read only if its size or modification time changed.
+        """
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            return None
+        key = os.path.abspath(filepath)
+        size, mtime_ns, file_hash = self.files.get(key, (None, None, None))
+        if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            file_hash = file_sha256(filepath)
+            self.files[key] = [stat.st_size, stat.st_mtime_ns, file_hash]
+        return file_hash
+
+    def key(self, node: Node) -> str:
+        """
+        Returns the hash of everything a node's outputs depend on.
+        """
+        action = f"{node.action.__module__}.{node.action.__qualname__}"
+        inputs = {filepath: self.file_hash(filepath) for filepath in node.inputs}
+        missing = [filepath for filepath, digest in inputs.items() if digest is None]
+        if missing:
+            raise FileNotFoundError(f"{node.name} is missing {', '.join(missing)}")
+        data = {"action": action, "args": node.args, "inputs": inputs}
+        encoded = json.dumps(data, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def fresh(self, node: Node, key: str) -> bool:
+        """
+        Returns whether a node ran with this key and its outputs are unchanged
+        since.
+        """
+        stamp = self.nodes.get(node.name)
+        if node.always or stamp is None or stamp["key"] != key:
+            return False
+        return all(
+            self.file_hash(filepath) == digest
+            for filepath, digest in stamp["outputs"].items()
+        )
+
+    def record(self, node: Node, key: str) -> None:
+        """
+        Stamps a node that has just run.
+        """
+        outputs = {filepath: self.file_hash(filepath) for filepath in node.outputs}
+        missing = [filepath for filepath, digest in outputs.items() if digest is None]
+        if missing:
+            raise FileNotFoundError(f"{node.name} did not write {', '.join(missing)}")
+        self.nodes[node.name] = {"key": key, "outputs": outputs}
+
+    def save(self) -> None:
+        """
+        Writes the stamps atomically.
+        """
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        data = {"version": BUILD_VERSION, "files": self.files, "nodes": self.nodes}
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_filename, self.filename)
+
+
+def run_graph(
+    nodes: List[Node],
+    stamps: Stamps,
+    workers: Optional[int] = None,
+    force: bool = False,
+) -> List[NodeName]:
+    """
+    Runs every node that is out of date once its dependencies are done,
+    spreading independent nodes over a pool of worker processes, and returns
+    the names of the nodes that ran. force runs every node.
+    """
+    by_name = {node.name: node for node in nodes}
+    waiting = {node.name: len(node.deps) for node in nodes}
+    dependents: Dict[NodeName, List[NodeName]] = {node.name: [] for node in nodes}
+    for node in nodes:
+        for dep in node.deps:
+            dependents[dep].append(node.name)
+
+    ran: List[NodeName] = []
+    ready = [name for name, count in waiting.items() if count == 0]
+    running: Dict[Future, Tuple[Node, str]] = {}
+
+    def finish(name: NodeName) -> None:
+        for dependent in dependents[name]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            while ready or running:
+                while ready:
+                    node = by_name[ready.pop()]
+                    key = stamps.key(node)
+                    if not force and stamps.fresh(node, key):
+                        finish(node.name)
+                    else:
+                        for filepath in node.outputs:
+                            os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+                        running[pool.submit(node.action, *node.args)] = (node, key)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node, key = running.pop(future)
+                    future.result()
+                    stamps.record(node, key)
+                    ran.append(node.name)
+                    print(f"{node.name}: done")
+                    finish(node.name)
+        except BaseException:
+            for future in running:
+                future.cancel()
+            raise
+        finally:
+            stamps.save()
+
+    unfinished = [name for name, count in waiting.items() if count > 0]
+    if unfinished:
+        raise ValueError(f"dependency cycle among {', '.join(sorted(unfinished))}")
+    return ran
+
+
+def scrape_sources(output_directory: FilePath) -> None:
+    """
+    Downloads the source SVGs, revalidating cached copies.
+    """
+    fetcher = CachedFetcher()
+    started = time.perf_counter()
+    try:
+        scrape(LINKS, fetcher, output_directory)
+    finally:
+        fetcher.save_index()
+    print(fetcher.summary(time.perf_counter() - started))
+
+
+def clean_and_split(
+    store: FilePath, delta_filenames: Dict[ProvinceName, FilePath]
+) -> None:
+    """
+    Cleans the store and writes every province's cleaned delta to its own
+    file, so each province can be stamped on its own delta alone.
+    """
+    clean_store(DEFAULT_REMOVED_CLASSES, store)
+    deltas = load_deltas(os.path.join(store, CLEANED_DELTAS_FILENAME))
+    for province, filename in delta_filenames.items():
+        save_deltas({province: deltas[province]}, filename)
+
+
+def rasterize_mask(
+    province: ProvinceName,
+    base: FilePath,
+    delta_filename: FilePath,
+    scale: float,
+    mask_filename: FilePath,
+    bbox_filename: FilePath,
+) -> None:
+    """
+    Renders one province and writes its cropped mask and bounding box. The
+    mask replaces the staged file instead of overwriting it, as the installed
+    mask may be a hard link to it.
+    """
+    out = io.StringIO()
+    filter_svg(base, out, (), load_deltas(delta_filename)[province])
+    temp_filename = mask_filename + ".tmp"
+    size = canvas_size(base, scale)
+    bbox = write_mask(out.getvalue().encode(), size, temp_filename)
+    if bbox is None:
+        raise ValueError(f"{province} has no highlighted pixels")
+    os.replace(temp_filename, mask_filename)
+    with open(bbox_filename, "w", encoding="utf-8") as f:
+        json.dump(list(bbox), f)
+
+
+def rasterize_background(base: FilePath, scale: float, filename: FilePath) -> None:
+    """
+    Renders the cleaned base, in which no province is highlighted.
+    """
+    with open(base, "rb") as f:
+        svg = f.read()
+    temp_filename = filename + ".tmp"
+    image = rasterize_svg(svg, canvas_size(base, scale))
+    image.save(temp_filename, "PNG", optimize=True)
+    os.replace(temp_filename, filename)
+
+
+def write_index(
+    base: FilePath,
+    scale: float,
+    bbox_filenames: Dict[ProvinceName, FilePath],
+    filename: FilePath,
+) -> None:
+    """
+    Writes masks.json from the bounding boxes, atomically.
+    """
+    bboxes = {}
+    for province, bbox_filename in bbox_filenames.items():
+        with open(bbox_filename, "r", encoding="utf-8") as f:
+            bboxes[province] = tuple(json.load(f))
+    index = mask_index(canvas_size(base, scale), scale, bboxes)
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=4)
+    os.replace(temp_filename, filename)
+
+
+def installed_masks(mask_directory: FilePath) -> MaskLayers:
+    """
+    Returns the masks installed in mask_directory.
+    """
+    layers = MaskLayers.load(mask_directory)
+    if layers is None:
+        raise FileNotFoundError(
+            f"no readable {MASKS_INDEX_FILENAME} in {mask_directory}"
+        )
+    return layers
+
+
+def build_labels(
+    mask_directory: FilePath, filename: FilePath, index_filename: FilePath
+) -> None:
+    """
+    Builds the province label raster from the installed masks.
+    """
+    layers = installed_masks(mask_directory)
+    raster, provinces = build_label_raster(layers.filenames, layers.decode, layers.size)
+    save_label_raster(raster, provinces, filename, index_filename)
+
+
+def build_mask_bundle(
+    mask_directory: FilePath, filename: FilePath, background_filename: FilePath
+) -> None:
+    """
+    Packs the installed background and masks into the asset bundle.
+    """
+    layers = installed_masks(mask_directory)
+    build_bundle(dict(layers.filenames), filename, background_filename, layers.decode)
+
+
+def build_graph(
+    sources: List[FilePath],
+    scrape_first: bool = False,
+    scale: float = 1.0,
+    store: FilePath = STORE_DIRECTORY,
+    build_directory: FilePath = BUILD_DIRECTORY,
+    install_directory: FilePath = MASKS_DIRECTORY,
+    background_filename: FilePath = BACKGROUND_FILENAME,
+    labels_filename: FilePath = LABELS_FILENAME,
+    labels_index_filename: FilePath = LABELS_INDEX_FILENAME,
+    bundle_filename: FilePath = BUNDLE_FILENAME,
+) -> List[Node]:
+    """
+    Returns the nodes that turn the source SVGs into the installed masks,
+    background, label raster and asset bundle. With scrape_first the sources
+    are downloaded first.
+    """
+    provinces = sorted(province_name(source) for source in sources)
+    if len(set(provinces)) != len(provinces):
+        raise ValueError("two source SVGs belong to the same province")
+    base = os.path.join(store, CLEANED_BASE_FILENAME)
+    staging = os.path.join(build_directory, "masks")
+    delta_filenames = {
+        province: os.path.join(build_directory, "deltas", f"{province}.json")
+        for province in provinces
+    }
+    bbox_filenames = {
+        province: os.path.join(staging, f"{province}.json") for province in provinces
+    }
+
+    nodes = []
+    if scrape_first:
+        nodes.append(
+            Node(
+                "scrape",
+                scrape_sources,
+                (DATA_DIRECTORY,),
+                outputs=sources,
+                always=True,
+            )
+        )
+    nodes.append(
+        Node(
+            "ingest",
+            ingest,
+            (sorted(sources), store),
+            inputs=sources,
+            outputs=[
+                os.path.join(store, BASE_FILENAME),
+                os.path.join(store, DELTAS_FILENAME),
+            ],
+            deps=["scrape"] if scrape_first else [],
+        )
+    )
+    nodes.append(
+        Node(
+            "clean",
+            clean_and_split,
+            (store, delta_filenames),
+            inputs=[
+                os.path.join(store, BASE_FILENAME),
+                os.path.join(store, DELTAS_FILENAME),
+            ],
+            outputs=[
+                base,
+                os.path.join(store, CLEANED_DELTAS_FILENAME),
+                *delta_filenames.values(),
+            ],
+            deps=["ingest"],
+        )
+    )
+    background = os.path.join(staging, MASK_BACKGROUND_FILENAME)
+    nodes.append(
+        Node(
+            "rasterize:background",
+            rasterize_background,
+            (base, scale, background),
+            inputs=[base],
+            outputs=[background],
+            deps=["clean"],
+        )
+    )
+    nodes.append(
+        Node(
+            "install:background",
+            install_file,
+            (background, os.path.join(install_directory, MASK_BACKGROUND_FILENAME)),
+            inputs=[background],
+            outputs=[os.path.join(install_directory, MASK_BACKGROUND_FILENAME)],
+            deps=["rasterize:background"],
+        )
+    )
+    nodes.append(
+        Node(
+            "install:map-background",
+            install_file,
+            (background, background_filename),
+            inputs=[background],
+            outputs=[background_filename],
+            deps=["rasterize:background"],
+        )
+    )
+    installed_filenames: List[FilePath] = []
+    for province in provinces:
+        mask = os.path.join(staging, f"{province}.png")
+        installed = os.path.join(install_directory, f"{province}.png")
+        installed_filenames.append(installed)
+        nodes.append(
+            Node(
+                f"rasterize:{province}",
+                rasterize_mask,
+                (
+                    province,
+                    base,
+                    delta_filenames[province],
+                    scale,
+                    mask,
+                    bbox_filenames[province],
+                ),
+                inputs=[base, delta_filenames[province]],
+                outputs=[mask, bbox_filenames[province]],
+                deps=["clean"],
+            )
+        )
+        nodes.append(
+            Node(
+                f"install:{province}",
+                install_file,
+                (mask, installed),
+                inputs=[mask],
+                outputs=[installed],
+                deps=[f"rasterize:{province}"],
+            )
+        )
+    index = os.path.join(install_directory, MASKS_INDEX_FILENAME)
+    nodes.append(
+        Node(
+            "install:index",
+            write_index,
+            (base, scale, bbox_filenames, index),
+            inputs=[base, *bbox_filenames.values()],
+            outputs=[index],
+            deps=[f"rasterize:{province}" for province in provinces],
+        )
+    )
+    installs = ["install:index", *(f"install:{province}" for province in provinces)]
+    nodes.append(
+        Node(
+            "labels",
+            build_labels,
+            (install_directory, labels_filename, labels_index_filename),
+            inputs=[index, *installed_filenames],
+            outputs=[labels_filename, labels_index_filename],
+            deps=installs,
+        )
+    )
+    nodes.append(
+        Node(
+            "bundle",
+            build_mask_bundle,
+            (install_directory, bundle_filename, background_filename),
+            inputs=[index, background_filename, *installed_filenames],
+            outputs=[bundle_filename],
+            deps=[*installs, "install:map-background"],
+        )
+    )
+    return nodes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the map assets")
+    parser.add_argument(
+        "sources",
+        nargs="*",
+        help="province SVG files (default: the files the scrape step downloads)",
+    )
+    parser.add_argument(
+        "--scrape",
+        action="store_true",
+        help="download the sources first, revalidating cached copies",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiple of the SVG canvas size to render at (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes (default: one per core)",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="run every step, even if up to date"
+    )
+    cli_args = parser.parse_args()
+
+    sources = cli_args.sources or [
+        os.path.join(DATA_DIRECTORY, svg_filename(link)) for link in LINKS
+    ]
+    started = time.perf_counter()
+    graph = build_graph(sources, cli_args.scrape, cli_args.scale)
+    ran = run_graph(graph, Stamps(), cli_args.workers, cli_args.force)
+    elapsed = time.perf_counter() - started
+    print(f"Ran {len(ran)} of {len(graph)} steps in {elapsed * 1000:.0f} ms")
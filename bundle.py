@@ -0,0 +1,214 @@
+"""
+Packed asset bundle: the background and every province mask in one file that
+is memory-mapped at runtime.
+
+Layout:
+
+    MAGIC | header length (uint32, little endian) | JSON header | data
+
+The background is stored as raw RGBA pixels and each province as a 1-bit
+mask of its bounding box, with rows padded to whole bytes (Pillow's raw "1"
+layout). The header holds the map size and the offset, length and bounding
+box of every entry; offsets count from the start of the data, which begins at
+the first 16-byte boundary after the header. Opening the bundle reads nothing
+but the header, and images are created directly over the mapped bytes.
+
+The header also records the size and modification time of every source file,
+so a bundle whose background or layers have changed since it was built can be
+told apart from a current one without decoding anything.
+
+Run this module to rebuild ./map/assets.bundle from the layers in ./map.
+"""
+
+import json
+import mmap
+import os
+import struct
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Tuple
+
+from PIL import Image
+
+from labels import HIGHLIGHT_COLOR, Color, find_layer_filenames
+from layers import (
+    BACKGROUND_FILENAME,
+    CroppedLayer,
+    decode_image,
+    decode_layer,
+    highlight_mask,
+)
+
+
+ProvinceName = str
+FilePath = str
+BoundingBox = Tuple[int, int, int, int]
+SourceStamps = Dict[FilePath, List[int]]
+
+BUNDLE_FILENAME = "./map/assets.bundle"
+BUNDLE_MAGIC = b"LMAPBDL1"
+HEADER_LENGTH = struct.Struct("<I")
+DATA_ALIGNMENT = 16
+
+
+def source_stamps(filepaths: Iterable[FilePath]) -> SourceStamps:
+    """
+    Returns the size and modification time of every file, as recorded in the
+    bundle header.
+    """
+    stamps = {}
+    for filepath in sorted(filepaths):
+        stat = os.stat(filepath)
+        stamps[filepath] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+
+def read_header(f: BinaryIO) -> Tuple[Dict[str, Any], int]:
+    """
+    Reads the header of a bundle from the start of an open file and returns
+    it with the position of its end. Raises ValueError if the file is not a
+    bundle.
+    """
+    if f.read(len(BUNDLE_MAGIC)) != BUNDLE_MAGIC:
+        raise ValueError(f"{f.name} is not an asset bundle")
+    packed_length = f.read(HEADER_LENGTH.size)
+    if len(packed_length) != HEADER_LENGTH.size:
+        raise ValueError(f"{f.name} is truncated")
+    (header_length,) = HEADER_LENGTH.unpack(packed_length)
+    encoded = f.read(header_length)
+    if len(encoded) != header_length:
+        raise ValueError(f"{f.name} is truncated")
+    return json.loads(encoded), f.tell()
+
+
+def bundle_is_current(
+    layer_filenames: Dict[ProvinceName, FilePath],
+    filename: FilePath = BUNDLE_FILENAME,
+    background_filename: FilePath = BACKGROUND_FILENAME,
+) -> bool:
+    """
+    Returns whether a bundle exists and was built from exactly the given
+    background and layers as they are now.
+    """
+    try:
+        with open(filename, "rb") as f:
+            header, _ = read_header(f)
+        sources = source_stamps([background_filename, *layer_filenames.values()])
+    except (OSError, ValueError):
+        return False
+    return header.get("sources") == sources
+
+
+def build_bundle(
+    layer_filenames: Dict[ProvinceName, FilePath],
+    filename: FilePath = BUNDLE_FILENAME,
+    background_filename: FilePath = BACKGROUND_FILENAME,
+    decode: Callable[[FilePath], CroppedLayer] = decode_layer,
+) -> None:
+    """
+    Packs the background and the highlight masks of the given layers, decoded
+    into cropped layers by decode, into a bundle file.
+    """
+    sources = source_stamps([background_filename, *layer_filenames.values()])
+    background = decode_image(background_filename)
+    chunks: List[bytes] = [background.tobytes()]
+    masks = {}
+    for province in sorted(layer_filenames):
+        layer, (x, y) = decode(layer_filenames[province])
+        mask = highlight_mask(layer)
+        crop = mask.getbbox()
+        if crop is None:
+            crop = bbox = (0, 0, 0, 0)
+        else:
+            bbox = (x + crop[0], y + crop[1], x + crop[2], y + crop[3])
+        masks[province] = {"bbox": list(bbox)}
+        packed = mask.crop(crop).convert("1", dither=Image.Dither.NONE)
+        chunks.append(packed.tobytes())
+
+    header = {
+        "size": list(background.size),
+        "background": {},
+        "masks": masks,
+        "sources": sources,
+    }
+    entries = [header["background"], *masks.values()]
+    offset = 0
+    for entry, chunk in zip(entries, chunks):
+        entry["offset"] = offset
+        entry["length"] = len(chunk)
+        offset += len(chunk) + -len(chunk) % DATA_ALIGNMENT
+    encoded = json.dumps(header).encode()
+
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "wb") as f:
+        f.write(BUNDLE_MAGIC)
+        f.write(HEADER_LENGTH.pack(len(encoded)))
+        f.write(encoded)
+        data_start = f.tell() + -f.tell() % DATA_ALIGNMENT
+        for entry, chunk in zip(entries, chunks):
+            f.write(b"\0" * (data_start + entry["offset"] - f.tell()))
+            f.write(chunk)
+    os.replace(temp_filename, filename)
+
+
+class AssetBundle:
+    """
+    A memory-mapped bundle. Images returned by background() and mask() share
+    memory with the mapping, so the bundle must stay open while they are used.
+    """
+
+    def __init__(self, filename: FilePath = BUNDLE_FILENAME):
+        with open(filename, "rb") as f:
+            header, header_end = read_header(f)
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mapping)
+        self.data_start = header_end + -header_end % DATA_ALIGNMENT
+        self.size: Tuple[int, int] = tuple(header["size"])
+        self.background_entry = header["background"]
+        self.masks: Dict[ProvinceName, dict] = header["masks"]
+
+    def chunk(self, entry: dict) -> memoryview:
+        """
+        Returns the mapped bytes of a header entry without copying them.
+        """
+        start = self.data_start + entry["offset"]
+        return self.view[start : start + entry["length"]]
+
+    def background(self) -> Image.Image:
+        """
+        Returns the background as a read-only RGBA image over the mapping.
+        """
+        return Image.frombuffer(
+            "RGBA", self.size, self.chunk(self.background_entry), "raw", "RGBA", 0, 1
+        )
+
+    def mask(self, province: ProvinceName) -> Tuple[Image.Image, BoundingBox]:
+        """
+        Returns the 1-bit mask of a province over the mapping, together with
+        the bounding box it covers.
+        """
+        entry = self.masks[province]
+        x0, y0, x1, y1 = entry["bbox"]
+        mask = Image.frombuffer(
+            "1", (x1 - x0, y1 - y0), self.chunk(entry), "raw", "1", 0, 1
+        )
+        return mask, (x0, y0, x1, y1)
+
+    def render(
+        self, provinces: Iterable[ProvinceName], color: Color = HIGHLIGHT_COLOR
+    ) -> Image.Image:
+        """
+        Returns a copy of the background with the provinces filled in color.
+        Provinces missing from the bundle or without pixels are skipped.
+        """
+        image = self.background().copy()
+        for province in sorted(provinces):
+            if province not in self.masks:
+                continue
+            mask, bbox = self.mask(province)
+            if mask.width and mask.height:
+                image.paste(color, bbox, mask)
+        return image
+
+
+if __name__ == "__main__":
+    build_bundle(find_layer_filenames())
+    print(f"Wrote {BUNDLE_FILENAME} ({os.path.getsize(BUNDLE_FILENAME)} bytes)")
@@ -0,0 +1,253 @@
+"""
+Off-screen rendering of the population charts shown in feature popups.
+
+Charts are drawn into Pillow images on a worker thread, so the Tk thread only
+has to wrap the finished image in a PhotoImage. The default "native" backend
+draws them with Pillow itself; the "matplotlib" backend uses matplotlib's Agg
+renderer and is only imported when it is selected.
+"""
+
+import math
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, List, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from lru import LRUCache
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+
+
+ChartKey = Tuple[Hashable, ...]
+ChartSlice = Tuple[str, int, str, float]
+ChartSlices = List[ChartSlice]
+ChartFunction = Callable[[ChartSlices], Image.Image]
+
+CHART_SIZE = (3.5, 2.5)
+CHART_DPI = 80
+CHART_PIXELS = (320, 200)
+PIE_RADIUS = 60
+BAR_HEIGHT = 24
+CHART_BACKENDS = ("native", "matplotlib")
+CHART_KINDS = ("pie", "bar")
+DEFAULT_CHART_CACHE_LIMIT = 32
+
+plot_state = threading.local()
+
+
+def population_slices(pop_with_feature: int, pop_without_feature: int) -> ChartSlices:
+    """
+    Returns the (label, size, color, explode) slices of the population pie,
+    leaving out empty slices.
+    """
+    slices = []
+    if pop_with_feature > 0:
+        slices.append(
+            (f"With Feature\n({pop_with_feature}M)", pop_with_feature, "#99ff99", 0.05)
+        )
+    if pop_without_feature > 0:
+        slices.append(
+            (
+                f"Without Feature\n({pop_without_feature}M)",
+                pop_without_feature,
+                "#ff9999",
+                0,
+            )
+        )
+    return slices
+
+
+def draw_centered_text(
+    draw: ImageDraw.ImageDraw, xy: Tuple[float, float], text: str, align: str
+) -> None:
+    """
+    Draws possibly multi-line text vertically centered on xy. align is "left",
+    "center" or "right" and says which edge of the text sits at xy.
+    """
+    font = ImageFont.load_default()
+    left, top, right, bottom = draw.multiline_textbbox((0, 0), text, font=font)
+    width, height = right - left, bottom - top
+    x, y = xy
+    if align == "center":
+        x -= width / 2
+    elif align == "right":
+        x -= width
+    draw.multiline_text(
+        (x - left, y - height / 2 - top), text, fill="black", font=font, align=align
+    )
+
+
+def draw_pie_chart(slices: ChartSlices) -> Image.Image:
+    """
+    Draws a pie chart with Pillow, starting at 12 o'clock and going
+    counter-clockwise like matplotlib's pie(startangle=90).
+    """
+    image = Image.new("RGBA", CHART_PIXELS, "white")
+    draw = ImageDraw.Draw(image)
+    center_x, center_y = CHART_PIXELS[0] / 2, CHART_PIXELS[1] / 2
+    total = sum(size for _, size, _, _ in slices)
+
+    start = 90.0
+    for label, size, color, explode in slices:
+        sweep = 360.0 * size / total
+        middle = math.radians(start + sweep / 2)
+        dx, dy = math.cos(middle), -math.sin(middle)
+        x = center_x + dx * explode * PIE_RADIUS
+        y = center_y + dy * explode * PIE_RADIUS
+        box = (x - PIE_RADIUS, y - PIE_RADIUS, x + PIE_RADIUS, y + PIE_RADIUS)
+        if sweep >= 360.0:
+            draw.ellipse(box, fill=color)
+        else:
+            draw.pieslice(box, -(start + sweep), -start, fill=color)
+
+        draw_centered_text(
+            draw,
+            (x + dx * PIE_RADIUS * 0.6, y + dy * PIE_RADIUS * 0.6),
+            f"{100.0 * size / total:.1f}%",
+            "center",
+        )
+        label_align = "left" if dx >= 0 else "right"
+        draw_centered_text(
+            draw,
+            (x + dx * PIE_RADIUS * 1.15, y + dy * PIE_RADIUS * 1.15),
+            label,
+            label_align,
+        )
+        start += sweep
+    return image
+
+
+def draw_bar_chart(slices: ChartSlices) -> Image.Image:
+    """
+    Draws a horizontal bar chart with Pillow, one bar per slice.
+    """
+    image = Image.new("RGBA", CHART_PIXELS, "white")
+    draw = ImageDraw.Draw(image)
+    label_width = CHART_PIXELS[0] * 0.4
+    bar_space = CHART_PIXELS[0] - label_width - 10
+    largest = max((size for _, size, _, _ in slices), default=1)
+    top = (CHART_PIXELS[1] - len(slices) * BAR_HEIGHT * 1.5) / 2
+
+    for i, (label, size, color, _) in enumerate(slices):
+        y = top + i * BAR_HEIGHT * 1.5
+        width = bar_space * size / largest
+        draw.rectangle(
+            (label_width, y, label_width + width, y + BAR_HEIGHT), fill=color
+        )
+        draw_centered_text(draw, (label_width - 5, y + BAR_HEIGHT / 2), label, "right")
+    return image
+
+
+def plot_chart(kind: str, slices: ChartSlices) -> Image.Image:
+    """
+    Draws a chart with matplotlib's Agg backend, importing matplotlib on
+    first use. Each thread reuses a single Figure that is cleared after every
+    chart, so no figures pile up waiting for the garbage collector.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = getattr(plot_state, "figure", None)
+    if fig is None:
+        fig = Figure(figsize=CHART_SIZE, dpi=CHART_DPI)
+        FigureCanvasAgg(fig)
+        plot_state.figure = fig
+    try:
+        return plot_chart_on(fig, kind, slices)
+    finally:
+        fig.clear()
+
+
+def plot_chart_on(fig: "Figure", kind: str, slices: ChartSlices) -> Image.Image:
+    """
+    Draws a chart onto an empty Agg-backed matplotlib Figure.
+    """
+    labels, sizes, colors, explode = zip(*slices) if slices else ((), (), (), ())
+
+    canvas = fig.canvas
+    ax = fig.add_subplot(111)
+
+    if kind == "bar":
+        ax.barh(labels, sizes, color=colors)
+        ax.invert_yaxis()
+    else:
+        ax.pie(
+            sizes,
+            explode=explode,
+            labels=labels,
+            colors=colors,
+            autopct="%1.1f%%",
+            shadow=False,
+            startangle=90,
+            textprops=dict(color="black", size=8),
+        )
+        ax.axis("equal")
+    fig.tight_layout()
+
+    canvas.draw()
+    width, height = canvas.get_width_height()
+    return Image.frombuffer(
+        "RGBA", (width, height), bytes(canvas.buffer_rgba()), "raw", "RGBA", 0, 1
+    )
+
+
+def chart_function(backend: str, kind: str) -> ChartFunction:
+    """
+    Returns the function that draws charts of the given kind with a backend.
+    """
+    if backend == "matplotlib":
+        return lambda slices: plot_chart(kind, slices)
+    return draw_bar_chart if kind == "bar" else draw_pie_chart
+
+
+class ChartRenderer:
+    """
+    Renders charts on a background thread and keeps the most recently used
+    results in an LRU cache, so reopening a popup reuses the finished image.
+    """
+
+    def __init__(
+        self, backend: str = "native", cache_limit: int = DEFAULT_CHART_CACHE_LIMIT
+    ):
+        self.backend = backend
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.cache: LRUCache[ChartKey, Image.Image] = LRUCache(cache_limit)
+        self.pending: Dict[ChartKey, Future] = {}
+        self.lock = threading.Lock()
+
+    def render(self, key: ChartKey, slices: ChartSlices, kind: str = "pie") -> Future:
+        """
+        Returns a future for the chart cached under key. A cached chart gives
+        an already completed future; a chart that is still rendering gives the
+        future of that render.
+        """
+        key = (self.backend, kind, *key)
+        with self.lock:
+            image = self.cache.get(key)
+            if image is not None:
+                future: Future = Future()
+                future.set_result(image)
+                return future
+            if key in self.pending:
+                return self.pending[key]
+            future = self.pool.submit(chart_function(self.backend, kind), slices)
+            self.pending[key] = future
+        future.add_done_callback(lambda f: self.finish(key, f))
+        return future
+
+    def finish(self, key: ChartKey, future: Future) -> None:
+        """
+        Moves a completed render from self.pending into the cache.
+        """
+        with self.lock:
+            self.pending.pop(key, None)
+            if not future.cancelled() and future.exception() is None:
+                self.cache.put(key, future.result())
+
+    def shutdown(self) -> None:
+        """
+        Stops the worker thread, dropping renders that have not started.
+        """
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,62 @@
+"""
+Off-screen compositing of province layers into a single map image with NumPy.
+"""
+
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+from PIL import Image
+
+from layers import Offset
+
+
+ProvinceName = str
+LayerArray = Tuple[np.ndarray, Offset]
+
+
+def blend_over(dst: np.ndarray, src: np.ndarray) -> None:
+    """
+    Alpha-blends the RGBA pixels of src over the same-sized region dst in
+    place. Both arrays are uint8 with shape (height, width, 4).
+    """
+    alpha = src[..., 3:4].astype(np.uint16)
+    inverse = 255 - alpha
+    dst[..., :3] = (src[..., :3] * alpha + dst[..., :3] * inverse + 127) // 255
+    dst[..., 3:4] = alpha + (dst[..., 3:4] * inverse + 127) // 255
+
+
+class LayerCompositor:
+    """
+    Holds the background and the cropped province layers as arrays and
+    renders any selection of provinces into one RGBA image. Rendering touches
+    only the bounding boxes of the selected layers and does not use Tk, so it
+    can run on a worker thread.
+    """
+
+    def __init__(self, background: Image.Image):
+        self.background = np.array(background.convert("RGBA"), dtype=np.uint8)
+        self.layers: Dict[ProvinceName, LayerArray] = {}
+
+    def add_layer(
+        self, province: ProvinceName, img: Image.Image, offset: Offset
+    ) -> None:
+        """
+        Registers a cropped RGBA province layer placed at offset.
+        """
+        pixels = np.array(img.convert("RGBA"), dtype=np.uint8)
+        self.layers[province] = (pixels, offset)
+
+    def render(self, provinces: Iterable[ProvinceName]) -> Image.Image:
+        """
+        Returns the background with the given provinces blended over it in
+        sorted order. Provinces without a registered layer are skipped.
+        """
+        out = self.background.copy()
+        for province in sorted(provinces):
+            layer = self.layers.get(province)
+            if layer is None:
+                continue
+            pixels, (x, y) = layer
+            height, width = pixels.shape[:2]
+            blend_over(out[y : y + height, x : x + width], pixels)
+        return Image.fromarray(out, "RGBA")
@@ -0,0 +1,219 @@
+"""
+Batch export of maps for every language subset and every feature.
+
+Every combination is resolved to its province set first, and combinations
+that cover the same provinces share one PNG, so each distinct map is rendered
+once. Maps are rendered by a pool of worker processes, each holding its own
+MapRenderer, and listed in a JSON manifest in the output directory. Maps
+already in the shared render cache are copied from it instead of rendered.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from query import Mask
+from render_cache import DEFAULT_RENDER_CACHE_DIR, RenderCache
+from renderer import RENDER_BACKENDS, MapRenderer
+
+
+ProvinceName = str
+FilePath = str
+Combination = Dict[str, Any]
+MapJob = Tuple[List[ProvinceName], FilePath]
+
+MANIFEST_FILENAME = "manifest.json"
+
+worker_renderer: Optional[MapRenderer] = None
+
+
+def language_combinations(map_renderer: MapRenderer) -> Iterator[Combination]:
+    """
+    Yields every subset of the languages, including the empty selection,
+    together with its language mask.
+    """
+    index = map_renderer.feature_index
+    for language_mask in range(1 << len(index.language_codes)):
+        languages = sorted(index.decode_languages(language_mask))
+        yield {
+            "kind": "languages",
+            "name": "+".join(languages) or "none",
+            "languages": languages,
+            "language_mask": language_mask,
+        }
+
+
+def feature_combinations(map_renderer: MapRenderer) -> Iterator[Combination]:
+    """
+    Yields every feature together with the mask of languages that have it.
+    """
+    index = map_renderer.feature_index
+    for feature in index.feature_names:
+        language_mask = index.feature_masks[feature]
+        yield {
+            "kind": "feature",
+            "name": feature,
+            "languages": sorted(index.decode_languages(language_mask)),
+            "language_mask": language_mask,
+        }
+
+
+def map_filename(province_mask: Mask) -> FilePath:
+    """
+    Returns the file name of the map showing the provinces in province_mask.
+    """
+    return f"map-{province_mask:x}.png"
+
+
+def init_worker(backend: str, cache_dir: Optional[FilePath]) -> None:
+    """
+    Creates the MapRenderer of a worker process.
+    """
+    global worker_renderer
+    cache = RenderCache(cache_dir) if cache_dir else None
+    worker_renderer = MapRenderer(backend=backend, cache=cache)
+
+
+def render_map(job: MapJob) -> FilePath:
+    """
+    Renders one map in a worker process and writes it to its file.
+    """
+    provinces, filepath = job
+    png = worker_renderer.render_png(provinces)
+    with open(filepath, "wb") as f:
+        f.write(png)
+    return filepath
+
+
+def plan_exports(
+    map_renderer: MapRenderer, combinations: List[Combination]
+) -> Dict[Mask, List[Combination]]:
+    """
+    Groups combinations by the provinces they cover, recording in each
+    combination the file of its map.
+    """
+    index = map_renderer.feature_index
+    groups: Dict[Mask, List[Combination]] = {}
+    for combination in combinations:
+        province_mask = index.provinces_for(combination.pop("language_mask"))
+        combination["file"] = map_filename(province_mask)
+        groups.setdefault(province_mask, []).append(combination)
+    return groups
+
+
+def export_maps(
+    output_dir: FilePath,
+    backend: str = "composite",
+    workers: Optional[int] = None,
+    include_languages: bool = True,
+    include_features: bool = True,
+    cache_dir: Optional[FilePath] = DEFAULT_RENDER_CACHE_DIR,
+) -> Dict[str, Any]:
+    """
+    Renders the requested combinations into output_dir, writes the manifest
+    and returns it. Progress and throughput are printed as maps finish.
+    cache_dir is the render cache directory, or None to always render. The
+    fully computed feature lattice is saved for the viewer and later runs.
+    """
+    map_renderer = MapRenderer(backend=backend)
+    index = map_renderer.feature_index
+    map_renderer.feature_lattice.materialize()
+    map_renderer.feature_lattice.save()
+    combinations: List[Combination] = []
+    if include_languages:
+        combinations.extend(language_combinations(map_renderer))
+    if include_features:
+        combinations.extend(feature_combinations(map_renderer))
+    groups = plan_exports(map_renderer, combinations)
+
+    os.makedirs(output_dir, exist_ok=True)
+    jobs: List[MapJob] = [
+        (
+            sorted(index.decode_provinces(province_mask)),
+            os.path.join(output_dir, map_filename(province_mask)),
+        )
+        for province_mask in sorted(groups)
+    ]
+    print(
+        f"{len(combinations)} combinations resolve to {len(jobs)} distinct maps",
+        file=sys.stderr,
+    )
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(backend, cache_dir)
+    ) as pool:
+        futures = [pool.submit(render_map, job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), start=1):
+            future.result()
+            elapsed = time.perf_counter() - started
+            print(
+                f"\r{done}/{len(jobs)} maps, {done / elapsed:.1f} maps/s",
+                end="",
+                file=sys.stderr,
+            )
+    elapsed = time.perf_counter() - started
+    print(f"\nRendered {len(jobs)} maps in {elapsed:.1f} s", file=sys.stderr)
+
+    manifest = {
+        "backend": backend,
+        "maps": {
+            map_filename(province_mask): sorted(index.decode_provinces(province_mask))
+            for province_mask in sorted(groups)
+        },
+        "combinations": combinations,
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render a map for every language subset and every feature"
+    )
+    parser.add_argument("output_dir", help="directory the maps are written to")
+    parser.add_argument(
+        "--backend",
+        choices=RENDER_BACKENDS,
+        default="composite",
+        help="how provinces are drawn (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes (default: one per core)",
+    )
+    parser.add_argument(
+        "--skip-languages",
+        action="store_true",
+        help="do not export the language subsets",
+    )
+    parser.add_argument(
+        "--skip-features", action="store_true", help="do not export the features"
+    )
+    parser.add_argument(
+        "--render-cache",
+        default=DEFAULT_RENDER_CACHE_DIR,
+        help="directory of the shared render cache (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-render-cache",
+        action="store_true",
+        help="always render instead of using the render cache",
+    )
+    cli_args = parser.parse_args()
+
+    export_maps(
+        cli_args.output_dir,
+        backend=cli_args.backend,
+        workers=cli_args.workers,
+        include_languages=not cli_args.skip_languages,
+        include_features=not cli_args.skip_features,
+        cache_dir=None if cli_args.no_render_cache else cli_args.render_cache,
+    )
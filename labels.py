@@ -0,0 +1,149 @@
+"""
+Province label raster: a single 8-bit image in which every pixel holds the id
+of the province it belongs to (0 for none), built once from the layers in
+./map. Any selection of provinces can then be rendered with one lookup table
+pass instead of stacking one image per province.
+
+Run this module to rebuild ./map/labels.png and ./map/labels.json.
+"""
+
+import glob
+import json
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from layers import (
+    BACKGROUND_FILENAME,
+    MAP_DIRECTORY,
+    CroppedLayer,
+    decode_layer,
+    highlight_mask,
+)
+
+
+ProvinceName = str
+FilePath = str
+Color = Tuple[int, int, int]
+
+LABELS_FILENAME = "./map/labels.png"
+LABELS_INDEX_FILENAME = "./map/labels.json"
+HIGHLIGHT_COLOR: Color = (255, 128, 128)
+MAX_PROVINCES = 255
+NON_LAYER_NAMES = {"background", "labels"}
+
+
+def find_layer_filenames(
+    directory: FilePath = MAP_DIRECTORY,
+) -> Dict[ProvinceName, FilePath]:
+    """
+    Returns the province layer PNGs in a map directory, keyed by province.
+    """
+    layer_filenames = {}
+    for filepath in sorted(glob.glob(os.path.join(directory, "*.png"))):
+        province = os.path.splitext(os.path.basename(filepath))[0]
+        if province not in NON_LAYER_NAMES:
+            layer_filenames[province] = filepath
+    return layer_filenames
+
+
+def build_label_raster(
+    layer_filenames: Dict[ProvinceName, FilePath],
+    decode: Callable[[FilePath], CroppedLayer] = decode_layer,
+    size: Optional[Tuple[int, int]] = None,
+) -> Tuple[Image.Image, List[ProvinceName]]:
+    """
+    Builds the label raster from the given province layers, decoded into
+    cropped layers by decode, at size (default: the size of the background).
+    Provinces get ids 1..N in sorted order; where highlights overlap the
+    later province wins.
+    """
+    provinces = sorted(layer_filenames)
+    if len(provinces) > MAX_PROVINCES:
+        raise ValueError(f"at most {MAX_PROVINCES} provinces fit in an 8-bit raster")
+    if size is None:
+        with Image.open(BACKGROUND_FILENAME) as background:
+            size = background.size
+
+    raster = Image.new("L", size, 0)
+    for province_id, province in enumerate(provinces, start=1):
+        layer, (x, y) = decode(layer_filenames[province])
+        mask = highlight_mask(layer)
+        raster.paste(province_id, (x, y, x + mask.width, y + mask.height), mask)
+    return raster, provinces
+
+
+def save_label_raster(
+    raster: Image.Image,
+    provinces: List[ProvinceName],
+    filename: FilePath = LABELS_FILENAME,
+    index_filename: FilePath = LABELS_INDEX_FILENAME,
+) -> None:
+    """
+    Writes the label raster and its id -> province index.
+    """
+    raster.save(filename, optimize=True)
+    with open(index_filename, "w", encoding="utf-8") as f:
+        json.dump({"provinces": provinces}, f, indent=4)
+
+
+class LabelRaster:
+    """
+    A loaded label raster that renders province selections over a background.
+    """
+
+    def __init__(self, raster: Image.Image, provinces: List[ProvinceName]):
+        self.raster = raster
+        self.provinces = provinces
+        self.province_ids: Dict[ProvinceName, int] = {
+            province: i for i, province in enumerate(provinces, start=1)
+        }
+
+    @classmethod
+    def load(
+        cls,
+        filename: FilePath = LABELS_FILENAME,
+        index_filename: FilePath = LABELS_INDEX_FILENAME,
+    ) -> "LabelRaster":
+        """
+        Loads a raster written by save_label_raster, building it in memory
+        from the layers in ./map if it has not been generated yet.
+        """
+        if not (os.path.exists(filename) and os.path.exists(index_filename)):
+            return cls(*build_label_raster(find_layer_filenames()))
+        with Image.open(filename) as img:
+            raster = img.convert("L")
+        with open(index_filename, "r", encoding="utf-8") as f:
+            provinces = json.load(f)["provinces"]
+        return cls(raster, provinces)
+
+    def mask(self, provinces: Iterable[ProvinceName]) -> Image.Image:
+        """
+        Returns an "L" mask that is 255 wherever one of the provinces is.
+        """
+        lut = [0] * 256
+        for province in provinces:
+            province_id = self.province_ids.get(province)
+            if province_id is not None:
+                lut[province_id] = 255
+        return self.raster.point(lut)
+
+    def render(
+        self,
+        background: Image.Image,
+        provinces: Iterable[ProvinceName],
+        color: Color = HIGHLIGHT_COLOR,
+    ) -> Image.Image:
+        """
+        Returns a copy of background with the provinces filled in color.
+        """
+        image = background.copy()
+        image.paste(color, mask=self.mask(provinces))
+        return image
+
+
+if __name__ == "__main__":
+    label_raster, label_provinces = build_label_raster(find_layer_filenames())
+    save_label_raster(label_raster, label_provinces)
+    print(f"Wrote {LABELS_FILENAME} with {len(label_provinces)} provinces")
@@ -0,0 +1,94 @@
+"""
+Language, feature and population tables shown by the viewer and used by the
+headless renderer and tools. The research behind the language and feature
+tables is cited at the top of main.py.
+"""
+
+from typing import Dict, Set
+
+
+ProvinceName = str
+LanguageCode = str
+FeatureName = str
+LanguageDict = Dict[LanguageCode, Set[ProvinceName]]
+NameDict = Dict[LanguageCode, str]
+FeatureDict = Dict[FeatureName, Set[LanguageCode]]
+PopulationDict = Dict[LanguageCode, int]
+
+
+LANGUAGES: LanguageDict = {
+    "CMN": {
+        "Beijing",
+        "Hebei",
+        "Tianjin",
+        "Liaoning",
+        "Jilin",
+        "Heilongjiang",
+        "Shandong",
+        "Henan",
+        "Ningxia",
+        "Gansu",
+        "Xinjiang",
+        "Sichuan",
+        "Chongqing",
+        "Guizhou",
+        "Hubei",
+        "Jiangsu",
+        "Guangxi",
+        "Shaanxi",
+        "Anhui",
+    },
+    "WUU": {"Shanghai", "Jiangsu", "Zhejiang", "Anhui", "Yunnan"},
+    "GAN": {"Jiangxi", "Anhui"},
+    "MIN": {"Fujian", "Guangdong", "Hainan"},
+    "YUE": {"Guangdong", "Guangxi"},
+    "HSN": {"Hunan"},
+    "HAK": {"Guangdong", "Guangxi", "Fujian", "Jiangxi"},
+    "CJY": {"Shanxi"},
+}
+
+LANGUAGE_NAMES: NameDict = {
+    "CMN": "Mandarin (官話)",
+    "WUU": "Wu (吳語)",
+    "GAN": "Gan (贛語)",
+    "MIN": "Min (閩語)",
+    "YUE": "Yue (Cantonese, 粵語)",
+    "HSN": "Xiang (湘語)",
+    "HAK": "Hakka (客家話)",
+    "CJY": "Jin (晉語)",
+}
+
+LANG_FEATURES: FeatureDict = {
+    "No Audible Release": {"WUU", "YUE", "GAN", "MIN", "HAK"},
+    "Voiced Consonants": {"MIN", "WUU", "HSN"},
+    "Literary and colloquial readings": {
+        "WUU",
+        "YUE",
+        "GAN",
+        "MIN",
+        "HSN",
+        "HAK",
+        "CJY",
+    },
+    "Reduced Diphthong": {"WUU"},
+    "No-Palatalization": {"WUU", "MIN", "YUE", "HAK"},
+    "Post-Verb Adv.": {"YUE"},
+    "Post-Noun Adj.": {"YUE", "MIN"},
+}
+
+LANGUAGE_POPULATIONS: PopulationDict = {
+    "CMN": 990,
+    "WUU": 80,
+    "GAN": 23,
+    "MIN": 75,
+    "YUE": 85,
+    "HSN": 38,
+    "HAK": 47,
+    "CJY": 48,
+}
+# Data estimated based on
+# Zhōngguó yǔyán dìtú jí 中国语言地图集：汉语方言卷
+# [Language Atlas of China: Chinese dialects] (in Chinese), vol. 2:
+# Hànyǔ fāngyán juǎn (2nd ed.), Beijing:
+# The Commercial Press, Chinese Academy of Social Sciences, 2012,
+# ISBN 978-7-100-07054-6
@@ -0,0 +1,82 @@
+"""
+Helpers for decoding and trimming the province layer images in ./map.
+
+Every layer is a full-frame copy of the locator map in which a single province
+is filled with the highlight colour. Everything else in the layer repeats the
+background map, so only the highlighted pixels need to be kept around.
+"""
+
+from typing import Tuple
+
+from PIL import Image, ImageChops
+
+ProvinceName = str
+FilePath = str
+Offset = Tuple[int, int]
+CroppedLayer = Tuple[Image.Image, Offset]
+
+MAP_DIRECTORY = "./map"
+BACKGROUND_FILENAME = "./map/background.png"
+
+# A pixel belongs to the highlighted province when its red channel exceeds
+# both green and blue by more than this amount (the fill is #ff8080).
+HIGHLIGHT_MIN_RED_EXCESS = 24
+
+
+def highlight_mask(img: Image.Image) -> Image.Image:
+    """
+    Returns an "L" mask of an RGBA layer that is 255 on the highlighted
+    province and 0 everywhere else.
+    """
+    red, green, blue, alpha = img.split()
+    excess = ImageChops.subtract(red, ImageChops.lighter(green, blue))
+    mask = excess.point(lambda v: 255 if v > HIGHLIGHT_MIN_RED_EXCESS else 0)
+    return ImageChops.multiply(mask, alpha.point(lambda v: 255 if v else 0))
+
+
+def isolate_highlight(img: Image.Image) -> Image.Image:
+    """
+    Returns a copy of an RGBA layer in which every pixel outside the
+    highlighted province is fully transparent.
+    """
+    mask = highlight_mask(img)
+    img = img.copy()
+    img.putalpha(ImageChops.multiply(img.getchannel("A"), mask))
+    return img
+
+
+def crop_to_content(img: Image.Image) -> CroppedLayer:
+    """
+    Crops an RGBA image to the bounding box of its non-transparent pixels and
+    returns the cropped image with the (x, y) offset of its top-left corner.
+    A fully transparent image is reduced to a single transparent pixel.
+    """
+    bbox = img.getchannel("A").getbbox()
+    if bbox is None:
+        return Image.new("RGBA", (1, 1), (0, 0, 0, 0)), (0, 0)
+    return img.crop(bbox), (bbox[0], bbox[1])
+
+
+def layer_filename(
+    province: ProvinceName, directory: FilePath = MAP_DIRECTORY
+) -> FilePath:
+    """
+    Returns the path of a province's layer PNG.
+    """
+    return f"{directory}/{province}.png"
+
+
+def decode_image(filepath: FilePath) -> Image.Image:
+    """
+    Decodes an image file fully and converts it to RGBA.
+    """
+    with Image.open(filepath) as img:
+        return img.convert("RGBA")
+
+
+def decode_layer(filepath: FilePath) -> CroppedLayer:
+    """
+    Decodes a province layer, drops the pixels it shares with the background
+    and crops it to the highlighted province.
+    """
+    return crop_to_content(isolate_highlight(decode_image(filepath)))
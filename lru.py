@@ -0,0 +1,86 @@
+"""
+A small least-recently-used cache shared by the viewer and its tools.
+"""
+
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Iterator, Optional, TypeVar
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    A mapping that keeps at most `limit` entries and evicts the least recently
+    used one when it grows past that. A limit of None disables eviction.
+    `on_evict` is called with the key and value of every evicted entry.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = None,
+        on_evict: Optional[Callable[[K, V], None]] = None,
+    ):
+        self.limit = limit
+        self.on_evict = on_evict
+        self.entries: "OrderedDict[K, V]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key: K) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(self.entries)
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """
+        Returns the value stored for key and marks it as most recently used.
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key: K, value: V) -> None:
+        """
+        Stores value under key as the most recently used entry, then evicts
+        old entries until the cache is back within its limit.
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.trim()
+
+    def pop(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        """
+        Removes key without calling on_evict and returns its value.
+        """
+        return self.entries.pop(key, default)
+
+    def trim(self) -> None:
+        """
+        Evicts least recently used entries until len(self) <= self.limit.
+        """
+        if self.limit is None:
+            return
+        while len(self.entries) > self.limit:
+            key, value = self.entries.popitem(last=False)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(key, value)
+
+    def clear(self) -> None:
+        """
+        Evicts every entry.
+        """
+        while self.entries:
+            key, value = self.entries.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(key, value)
@@ -8,15 +8,30 @@ Database of Ancient and Modern Pronunciations of Chinese Characters, National Sc
 (漢字古今音資料庫 中華民國行政院國家科學委員會 2017年01月01日)
 """
 
+import argparse
+import importlib.util
+from concurrent.futures import Future, ThreadPoolExecutor
 import tkinter as tk
 from tkinter import messagebox
 from PIL import Image, ImageTk
 import os
-from typing import Dict, Set, Optional, List
+import time
+from typing import Callable, Dict, Set, Optional, List, Tuple, TypeVar
 import webbrowser
 import json
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+from charts import CHART_BACKENDS, CHART_KINDS, ChartRenderer, population_slices
+from language_data import (
+    LANG_FEATURES,
+    LANGUAGE_NAMES,
+    LANGUAGE_POPULATIONS,
+    LANGUAGES,
+)
+from layers import BACKGROUND_FILENAME, Offset, decode_image
+from lru import LRUCache
+from query import Mask, QuerySyntaxError
+from render_cache import RenderCache
+from renderer import MapRenderer
 
 
 ProvinceName = str
@@ -28,102 +43,166 @@ LanguageDict = Dict[LanguageCode, ProvinceSet]
 NameDict = Dict[LanguageCode, str]
 LayerDict = Dict[ProvinceName, FilePath]
 PhotoImageDict = Dict[ProvinceName, ImageTk.PhotoImage]
+OffsetDict = Dict[ProvinceName, Offset]
 CanvasItemDict = Dict[ProvinceName, int]
 BooleanVarDict = Dict[LanguageCode, tk.BooleanVar]
 FeatureDict = Dict[FeatureName, Set[LanguageCode]]
 FeatureBoolVarDict = Dict[FeatureName, tk.BooleanVar]
 FeatureDetailDict = Dict[FeatureName, Dict[str, str]]
 PopulationDict = Dict[LanguageCode, int]
+FutureDict = Dict[FilePath, Future]
+Decoded = TypeVar("Decoded")
+
+
+DEFAULT_LAYER_CACHE_LIMIT = 12
+RENDERERS = ("layers", "labels", "composite", "bundle")
+RENDER_POLL_MS = 5
+
+
+class FeatureInfoPanel(tk.Toplevel):
+    """
+    Feature details window that is built once and updated in place for every
+    feature. Closing it only hides it, so repeated popups allocate no new
+    widgets; the previous chart image is released as soon as it is replaced.
+    """
+
+    def __init__(self, master: tk.Misc):
+        tk.Toplevel.__init__(self, master)
+        self.protocol("WM_DELETE_WINDOW", self.withdraw)
+        self.link_url: Optional[str] = None
+        self.chart_future: Optional[Future] = None
+        self.chart_image: Optional[ImageTk.PhotoImage] = None
+
+        self.name_label = tk.Label(self, font="-weight bold")
+        self.name_label.pack(pady=(10, 5), padx=10)
+
+        self.desc_label = tk.Label(self, wraplength=330, justify=tk.LEFT)
+        self.desc_label.pack(pady=5, padx=10, anchor="w", fill=tk.X)
+
+        tk.Label(
+            self, text="Languages with this feature:", font="-underline true"
+        ).pack(pady=(10, 2), anchor="w", padx=10)
+
+        lang_frame = tk.Frame(self)
+        self.lang_label = tk.Label(lang_frame, justify=tk.LEFT)
+        self.lang_label.pack(side=tk.LEFT)
+        lang_frame.pack(pady=2, padx=10, anchor="w")
+
+        tk.Label(self, text="Population:", font="-underline true").pack(
+            pady=(10, 2), anchor="w", padx=10
+        )
+        chart_frame = tk.Frame(self)
+        self.chart_label = tk.Label(chart_frame)
+        self.chart_label.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        chart_frame.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
 
+        self.link_button = tk.Button(
+            self, text="Open Wikipedia Page", command=self.open_link
+        )
+        self.close_button = tk.Button(self, text="Close", command=self.withdraw)
+        self.close_button.pack(pady=(5, 10))
+
+    def show_feature(
+        self,
+        feature_name: FeatureName,
+        description: str,
+        language_names_list: List[str],
+        link_url: Optional[str],
+        chart_future: Future,
+    ) -> None:
+        """
+        Replaces the panel contents with the given feature and brings the
+        panel to the front. The chart appears once chart_future completes.
+        """
+        self.title(f"Feature Info: {feature_name}")
+        self.name_label.configure(text=feature_name)
+        self.desc_label.configure(text=description)
+        self.lang_label.configure(text="\n".join(language_names_list))
+
+        self.link_url = link_url
+        if link_url:
+            self.link_button.pack(pady=(5, 5), before=self.close_button)
+        else:
+            self.link_button.pack_forget()
 
-BACKGROUND_FILENAME = "./map/background.png"
+        self.chart_label.configure(image="", text="Rendering chart...")
+        self.chart_image = None
+        self.chart_future = chart_future
+        self.show_chart_when_ready(chart_future)
 
-with Image.open(BACKGROUND_FILENAME) as img:
-    IMAGE_WIDTH, IMAGE_HEIGHT = img.size
+        self.deiconify()
+        self.lift()
+
+    def show_chart_when_ready(self, future: Future) -> None:
+        """
+        Puts a chart rendered in the background into the panel once it is
+        finished, polling from the Tk event loop until then. Charts of a
+        feature that has since been replaced are dropped, and a chart that
+        failed to render is replaced by its error.
+        """
+        if future is not self.chart_future or not self.winfo_exists():
+            return
+        if not future.done():
+            self.after(RENDER_POLL_MS, self.show_chart_when_ready, future)
+            return
+        try:
+            chart = future.result()
+        except Exception as e:
+            self.chart_label.configure(image="", text=f"Chart unavailable: {e}")
+            return
+        self.chart_image = ImageTk.PhotoImage(chart)
+        self.chart_label.configure(image=self.chart_image, text="")
+
+    def open_link(self) -> None:
+        """
+        Opens the link of the feature currently shown.
+        """
+        if self.link_url:
+            webbrowser.open_new_tab(self.link_url)
 
 
 class LanguageMapApp(tk.Tk):
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        renderer: str = "layers",
+        lazy_layers: bool = False,
+        layer_cache_limit: Optional[int] = DEFAULT_LAYER_CACHE_LIMIT,
+        decode_workers: Optional[int] = None,
+        measure_renders: bool = False,
+        chart_backend: str = "native",
+        chart_kind: str = "pie",
+        render_cache: Optional[FilePath] = None,
+        **kwargs,
+    ):
         """
         Initialize the application window, load data, and set up widgets.
+
+        renderer selects how selections are drawn: "layers" stacks one canvas
+        item per province, "labels" renders the province label raster into a
+        single image, "composite" alpha-blends the selected layers into a
+        single image on a worker thread and "bundle" fills province masks from
+        the memory-mapped asset bundle, decoding no PNG at all.
+
+        With lazy_layers, the "layers" renderer decodes province layers the
+        first time they are shown and keeps at most layer_cache_limit hidden
+        layers loaded (None keeps every layer once loaded). Images are decoded
+        on a pool of decode_workers threads; only PhotoImage creation runs on
+        the Tk thread. measure_renders records the latency of every redraw,
+        including Tk's repaint, and prints a summary when the window closes.
+        chart_backend selects who draws the feature popup charts: "native"
+        uses Pillow, "matplotlib" imports matplotlib on first use, and
+        chart_kind is "pie" or "bar". With a
+        render_cache directory, the single image renderers read maps from the
+        shared render cache and add the maps they render to it.
         """
         tk.Tk.__init__(self, *args, **kwargs)
         self.title("Language Distribution Map Viewer")
 
-        self.languages: LanguageDict = {
-            "CMN": {
-                "Beijing",
-                "Hebei",
-                "Tianjin",
-                "Liaoning",
-                "Jilin",
-                "Heilongjiang",
-                "Shandong",
-                "Henan",
-                "Ningxia",
-                "Gansu",
-                "Xinjiang",
-                "Sichuan",
-                "Chongqing",
-                "Guizhou",
-                "Hubei",
-                "Jiangsu",
-                "Guangxi",
-                "Shaanxi",
-                "Anhui",
-            },
-            "WUU": {"Shanghai", "Jiangsu", "Zhejiang", "Anhui", "Yunnan"},
-            "GAN": {"Jiangxi", "Anhui"},
-            "MIN": {"Fujian", "Guangdong", "Hainan"},
-            "YUE": {"Guangdong", "Guangxi"},
-            "HSN": {"Hunan"},
-            "HAK": {"Guangdong", "Guangxi", "Fujian", "Jiangxi"},
-            "CJY": {"Shanxi"},
-        }
-        self.language_names: NameDict = {
-            "CMN": "Mandarin (官話)",
-            "WUU": "Wu (吳語)",
-            "GAN": "Gan (贛語)",
-            "MIN": "Min (閩語)",
-            "YUE": "Yue (Cantonese, 粵語)",
-            "HSN": "Xiang (湘語)",
-            "HAK": "Hakka (客家話)",
-            "CJY": "Jin (晉語)",
-        }
-        self.lang_features: FeatureDict = {
-            "No Audible Release": {"WUU", "YUE", "GAN", "MIN", "HAK"},
-            "Voiced Consonants": {"MIN", "WUU", "HSN"},
-            "Literary and colloquial readings": {
-                "WUU",
-                "YUE",
-                "GAN",
-                "MIN",
-                "HSN",
-                "HAK",
-                "CJY",
-            },
-            "Reduced Diphthong": {"WUU"},
-            "No-Palatalization": {"WUU", "MIN", "YUE", "HAK"},
-            "Post-Verb Adv.": {"YUE"},
-            "Post-Noun Adj.": {"YUE", "MIN"},
-        }
-
-        self.language_populations: PopulationDict = {
-            "CMN": 990,
-            "WUU": 80,
-            "GAN": 23,
-            "MIN": 75,
-            "YUE": 85,
-            "HSN": 38,
-            "HAK": 47,
-            "CJY": 48,
-        }
-        # Data estimated based on
-        # Zhōngguó yǔyán dìtú jí 中国语言地图集：汉语方言卷
-        # [Language Atlas of China: Chinese dialects] (in Chinese), vol. 2:
-        # Hànyǔ fāngyán juǎn (2nd ed.), Beijing:
-        # The Commercial Press, Chinese Academy of Social Sciences, 2012,
-        # ISBN 978-7-100-07054-6
+        self.languages: LanguageDict = LANGUAGES
+        self.language_names: NameDict = LANGUAGE_NAMES
+        self.lang_features: FeatureDict = LANG_FEATURES
+        self.language_populations: PopulationDict = LANGUAGE_POPULATIONS
 
         feature_details_path = "./feature_details.json"
 
@@ -133,21 +212,58 @@ class LanguageMapApp(tk.Tk):
         self.all_provinces: ProvinceSet = (
             set().union(*self.languages.values())
         )
-        self.layer_filenames: LayerDict = {
-            province: f"./map/{province}.png" for province in self.all_provinces
-        }
+        self.map_renderer = MapRenderer(
+            self.languages,
+            self.lang_features,
+            backend="composite" if renderer == "layers" else renderer,
+            cache=RenderCache(render_cache) if render_cache else None,
+        )
+        self.layer_filenames: LayerDict = self.map_renderer.layer_filenames
+        self.feature_index = self.map_renderer.feature_index
+        self.query_engine = self.map_renderer.query_engine
+        self.feature_lattice = self.map_renderer.feature_lattice
 
         self.province_layer_images: PhotoImageDict = {}
+        self.province_layer_offsets: OffsetDict = {}
         self.province_canvas_items: CanvasItemDict = {}
+        self.shown_provinces: ProvinceSet = set()
+        self.renderer = renderer
+        self.bg_image: Optional[Image.Image] = None
+        self.map_photo_image: Optional[ImageTk.PhotoImage] = None
+        self.render_pool = ThreadPoolExecutor(max_workers=1)
+        self.pending_render: Optional[Future] = None
+        self.pending_render_started = 0.0
+        self.measure_renders = measure_renders
+        self.render_times: List[float] = []
+        self.pending_map_update: Optional[str] = None
+        self.redraws_coalesced = 0
+        self.lazy_layers = lazy_layers
+        self.layer_cache_limit = layer_cache_limit
+        self.layer_cache: LRUCache[ProvinceName, int] = LRUCache(
+            layer_cache_limit,
+            on_evict=lambda province, item_id: self.unload_province_layer(province),
+        )
+        self.decode_pool = ThreadPoolExecutor(max_workers=decode_workers)
+        self.pending_decodes: FutureDict = {}
         self.language_vars: BooleanVarDict = {}
         self.feature_vars: FeatureBoolVarDict = {}
+        self.query_var = tk.StringVar(self)
+        self.chart_renderer = ChartRenderer(chart_backend)
+        self.chart_kind = chart_kind
+        self.info_panel: Optional[FeatureInfoPanel] = None
         self.bg_photo_image: Optional[ImageTk.PhotoImage] = None
 
+        self.prefetch_images()
+        self.bg_image = self.load_background_image()
+
         main_frame = tk.Frame(self)
         main_frame.pack(fill=tk.BOTH, expand=True)
 
         self.canvas = tk.Canvas(
-            main_frame, width=IMAGE_WIDTH, height=IMAGE_HEIGHT, bg="white"
+            main_frame,
+            width=self.bg_image.width,
+            height=self.bg_image.height,
+            bg="white",
         )
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
@@ -181,52 +297,171 @@ class LanguageMapApp(tk.Tk):
             lambda e: controls_canvas.itemconfig(controls_canvas_window, width=e.width),
         )
 
-        self.load_background()
-        self.load_province_layers()
+        if self.renderer in ("labels", "bundle"):
+            self.load_map_image()
+        elif self.renderer == "composite":
+            self.load_map_image()
+            self.map_renderer.ensure_layers(self.all_provinces, self.decode)
+        else:
+            self.load_background()
+            if not self.lazy_layers:
+                self.load_province_layers()
         self.create_controls(controls_frame_inner)
         self.update_map_display()
 
-    def load_image(
-        self, filepath: FilePath, item_name: str
-    ) -> Optional[ImageTk.PhotoImage]:
+    def destroy(self) -> None:
+        """
+        Cancels outstanding decodes and renders before tearing down the window.
+        """
+        self.decode_pool.shutdown(wait=False, cancel_futures=True)
+        self.render_pool.shutdown(wait=False, cancel_futures=True)
+        self.chart_renderer.shutdown()
+        if self.measure_renders and self.render_times:
+            timings = sorted(self.render_times)
+            print(
+                f"{self.renderer}: {len(timings)} redraws, "
+                f"median {timings[len(timings) // 2] * 1000:.1f} ms, "
+                f"max {timings[-1] * 1000:.1f} ms, "
+                f"{self.redraws_coalesced} redundant redraws avoided"
+            )
+        tk.Tk.destroy(self)
+
+    def prefetch(
+        self, filepath: FilePath, decoder: Callable[[FilePath], Decoded]
+    ) -> None:
         """
-        Loads an image using Pillow, converts to RGBA,
-        and returns a PhotoImage object.
+        Starts decoding a file on self.decode_pool unless it is already queued.
         """
-        img = Image.open(filepath)
-        img = img.convert("RGBA")
-        photo_image = ImageTk.PhotoImage(img)
-        return photo_image
+        if filepath not in self.pending_decodes:
+            self.pending_decodes[filepath] = self.decode_pool.submit(decoder, filepath)
+
+    def prefetch_images(self) -> None:
+        """
+        Queues the background and, unless layers are loaded lazily, every
+        province layer for decoding so the work overlaps with widget setup.
+        The "bundle" renderer decodes nothing.
+        """
+        if self.renderer == "bundle":
+            return
+        self.prefetch(BACKGROUND_FILENAME, decode_image)
+        if self.renderer == "composite" or (
+            self.renderer == "layers" and not self.lazy_layers
+        ):
+            for filename in self.layer_filenames.values():
+                self.prefetch(filename, self.map_renderer.decode_layer)
+
+    def decode(
+        self, filepath: FilePath, decoder: Callable[[FilePath], Decoded]
+    ) -> Decoded:
+        """
+        Returns the decoded file, waiting for a prefetched result if there is
+        one and decoding it on the calling thread otherwise.
+        """
+        future = self.pending_decodes.pop(filepath, None)
+        if future is None:
+            return decoder(filepath)
+        return future.result()
+
+    def load_background_image(self) -> Image.Image:
+        """
+        Returns the background image, which is opened only here. The
+        "bundle" renderer maps it from the asset bundle instead of decoding
+        the PNG.
+        """
+        if self.renderer == "bundle":
+            self.map_renderer.load()
+            return self.map_renderer.background
+        return self.decode(BACKGROUND_FILENAME, decode_image)
 
     def load_background(self) -> None:
         """
         Loads the background image and places it on the canvas.
         Stores the PhotoImage in self.bg_photo_image to prevent garbage collection.
         """
-        self.bg_photo_image = self.load_image(BACKGROUND_FILENAME, "background")
+        self.bg_photo_image = ImageTk.PhotoImage(self.bg_image)
         self.canvas.create_image(
             0, 0, anchor="nw", image=self.bg_photo_image, tags="background"
         )
 
+    def load_map_image(self) -> None:
+        """
+        Loads the headless map renderer and places a single map image on the
+        canvas that every redraw of the single image renderers draws the
+        current selection into.
+        """
+        self.map_renderer.load(self.bg_image)
+        self.map_photo_image = ImageTk.PhotoImage(self.bg_image)
+        self.canvas.create_image(
+            0, 0, anchor="nw", image=self.map_photo_image, tags="map"
+        )
+
+    def load_layer_image(self, filepath: FilePath) -> Tuple[ImageTk.PhotoImage, Offset]:
+        """
+        Loads a province layer cropped to its highlighted province, from its
+        rasterized mask when the renderer has masks, and returns the
+        PhotoImage together with the offset it must be placed at.
+        """
+        img, offset = self.decode(filepath, self.map_renderer.decode_layer)
+        return ImageTk.PhotoImage(img), offset
+
+    def load_province_layer(self, province: ProvinceName) -> int:
+        """
+        Loads the layer image of a single province, stores the cropped
+        PhotoImage in self.province_layer_images and its offset in
+        self.province_layer_offsets, and places it hidden on the canvas,
+        storing the item ID in self.province_canvas_items.
+        """
+        photo_img, offset = self.load_layer_image(self.layer_filenames[province])
+        self.province_layer_images[province] = photo_img
+        self.province_layer_offsets[province] = offset
+        x, y = offset
+        item_id = self.canvas.create_image(
+            x,
+            y,
+            anchor="nw",
+            image=photo_img,
+            state="hidden",
+            tags=("layer", province),
+        )
+        self.province_canvas_items[province] = item_id
+        return item_id
+
     def load_province_layers(self) -> None:
         """
-        Loads all province layer images specified in self.layer_filenames,
-        stores the PhotoImage objects in self.province_layer_images,
-        and places them hidden on the canvas, storing item IDs in
-        self.province_canvas_items.
-        """
-        for province, filename in self.layer_filenames.items():
-            photo_img = self.load_image(filename, province)
-            self.province_layer_images[province] = photo_img
-            item_id = self.canvas.create_image(
-                0,
-                0,
-                anchor="nw",
-                image=photo_img,
-                state="hidden",
-                tags=("layer", province),
+        Loads all province layer images specified in self.layer_filenames.
+        """
+        for province in self.layer_filenames:
+            self.load_province_layer(province)
+
+    def unload_province_layer(self, province: ProvinceName) -> None:
+        """
+        Deletes the canvas item of a lazily loaded province layer and drops
+        its PhotoImage so that Tk can free the pixel data.
+        """
+        item_id = self.province_canvas_items.pop(province, None)
+        if item_id is not None:
+            self.canvas.delete(item_id)
+        self.province_layer_images.pop(province, None)
+        self.province_layer_offsets.pop(province, None)
+
+    def ensure_province_layers(self, provinces: ProvinceSet) -> None:
+        """
+        Makes sure the given provinces have a canvas item, loading missing
+        layers on demand, and evicts the least recently used hidden layers
+        once more than self.layer_cache_limit layers are loaded. The cache is
+        trimmed even when nothing is missing, so shrinking the selection
+        releases the layers that no longer fit.
+        """
+        if self.layer_cache_limit is not None:
+            self.layer_cache.limit = self.layer_cache_limit + len(provinces)
+        missing = [p for p in provinces if self.layer_cache.get(p) is None]
+        self.layer_cache.trim()
+        for province in missing:
+            self.prefetch(
+                self.layer_filenames[province], self.map_renderer.decode_layer
             )
-            self.province_canvas_items[province] = item_id
+        for province in missing:
+            self.layer_cache.put(province, self.load_province_layer(province))
 
     def create_controls(self, parent_frame: tk.Frame) -> None:
         """
@@ -253,7 +488,7 @@ class LanguageMapApp(tk.Tk):
                 text=display_name,
                 variable=var,
                 anchor="w",
-                command=self.update_map_display,
+                command=self.schedule_map_update,
             )
             chk.grid(row=i, column=0, sticky="w", padx=(5, 2), pady=1)
 
@@ -298,6 +533,22 @@ class LanguageMapApp(tk.Tk):
             )
             info_button.grid(row=i, column=1, sticky="e", padx=(2, 5), pady=1)
 
+        tk.Label(parent_frame, text="Query:", font="-weight bold").pack(
+            pady=(10, 2), anchor="w", padx=10
+        )
+
+        query_frame = tk.Frame(parent_frame)
+        query_frame.pack(fill="x", expand=True, anchor="w", padx=10)
+
+        query_entry = tk.Entry(query_frame, textvariable=self.query_var)
+        query_entry.pack(side=tk.LEFT, fill="x", expand=True, padx=(5, 2))
+        query_entry.bind("<Return>", lambda e: self.apply_feature_query())
+
+        query_button = tk.Button(
+            query_frame, text="Apply", command=self.apply_feature_query
+        )
+        query_button.pack(side=tk.RIGHT, padx=(2, 5))
+
         button_frame = tk.Frame(parent_frame)
         button_frame.pack(pady=(15, 5), padx=10, anchor="w", fill="x")
 
@@ -323,12 +574,9 @@ class LanguageMapApp(tk.Tk):
 
     def show_feature_info(self, feature_name: FeatureName) -> None:
         """
-        Displays a Toplevel window with details about the selected feature,
-        including population pie chart, languages, and a web link button.
+        Shows details about the selected feature, including population pie
+        chart, languages, and a web link button, in the reusable info panel.
         """
-        popup = tk.Toplevel(self)
-        popup.title(f"Feature Info: {feature_name}")
-
         details = self.feature_details.get(feature_name, {})
         description = details.get("desc", "No description available.")
         wiki_link_url = details.get("link")
@@ -336,7 +584,6 @@ class LanguageMapApp(tk.Tk):
 
         pop_with_feature = 0
         pop_without_feature = 0
-        total_pop = 0
         all_app_langs = set(self.language_populations.keys())
         langs_without_feature = all_app_langs - langs_with_feature
 
@@ -345,88 +592,21 @@ class LanguageMapApp(tk.Tk):
         for lang_code in langs_without_feature:
             pop_without_feature += self.language_populations.get(lang_code)
 
-        total_pop = pop_with_feature + pop_without_feature
-
         language_names_list = sorted(
             [self.language_names.get(code) for code in langs_with_feature]
         )
 
-        tk.Label(popup, text=feature_name, font="-weight bold").pack(
-            pady=(10, 5), padx=10
-        )
-
-        desc_label = tk.Label(popup, text=description, wraplength=330, justify=tk.LEFT)
-        desc_label.pack(pady=5, padx=10, anchor="w", fill=tk.X)
-
-        tk.Label(
-            popup, text="Languages with this feature:", font="-underline true"
-        ).pack(pady=(10, 2), anchor="w", padx=10)
-
-        lang_frame = tk.Frame(popup)
-        lang_label = tk.Label(
-            lang_frame,
-            text=("\n".join(language_names_list)),
-            justify=tk.LEFT,
+        chart_future = self.chart_renderer.render(
+            ("population", feature_name, pop_with_feature, pop_without_feature),
+            population_slices(pop_with_feature, pop_without_feature),
+            self.chart_kind,
         )
-        lang_label.pack(side=tk.LEFT)
-        lang_frame.pack(pady=2, padx=10, anchor="w")
 
-        tk.Label(popup, text="Population:", font="-underline true").pack(
-            pady=(10, 2), anchor="w", padx=10
+        if self.info_panel is None or not self.info_panel.winfo_exists():
+            self.info_panel = FeatureInfoPanel(self)
+        self.info_panel.show_feature(
+            feature_name, description, language_names_list, wiki_link_url, chart_future
         )
-        chart_frame = tk.Frame(popup)
-
-        labels = []
-        sizes = []
-        colors = []
-        explode_list = []
-
-        if pop_with_feature > 0:
-            labels.append(f"With Feature\n({pop_with_feature}M)")
-            sizes.append(pop_with_feature)
-            colors.append("#99ff99")
-            explode_list.append(0.05)
-
-        if pop_without_feature > 0:
-            labels.append(f"Without Feature\n({pop_without_feature}M)")
-            sizes.append(pop_without_feature)
-            colors.append("#ff9999")
-            explode_list.append(0)
-
-        explode = tuple(explode_list)
-
-        fig = Figure(figsize=(3.5, 2.5), dpi=80)
-        ax = fig.add_subplot(111)
-
-        wedges, texts, autotexts = ax.pie(
-            sizes,
-            explode=explode,
-            labels=labels,
-            colors=colors,
-            autopct="%1.1f%%",
-            shadow=False,
-            startangle=90,
-            textprops=dict(color="black", size=8),
-        )
-
-        ax.axis("equal")
-        fig.tight_layout()
-
-        canvas = FigureCanvasTkAgg(fig, master=chart_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
-
-        chart_frame.pack(pady=5, padx=10, fill=tk.BOTH, expand=True)
-        if wiki_link_url:
-            link_button = tk.Button(
-                popup,
-                text="Open Wikipedia Page",
-                command=lambda url=wiki_link_url: webbrowser.open_new_tab(url),
-            )
-            link_button.pack(pady=(5, 5))
-
-        close_button = tk.Button(popup, text="Close", command=popup.destroy)
-        close_button.pack(pady=(5, 10))
 
     def deselect_all(self) -> None:
         """
@@ -436,7 +616,7 @@ class LanguageMapApp(tk.Tk):
             lang_var.set(False)
         for feature_var in self.feature_vars.values():
             feature_var.set(False)
-        self.update_map_display()
+        self.schedule_map_update()
 
     def update_languages_based_on_all_features(self) -> None:
         """
@@ -447,49 +627,206 @@ class LanguageMapApp(tk.Tk):
             name for name, var in self.feature_vars.items() if var.get()
         ]
 
-        languages_to_select: Set[LanguageCode] = set()
+        language_mask = 0
+        if selected_features:
+            feature_mask = self.feature_lattice.encode_features(selected_features)
+            language_mask = self.feature_lattice.lookup(feature_mask)[0]
 
-        if not selected_features:
-            for var in self.language_vars.values():
-                var.set(False)
-        else:
-            first_feature_name = selected_features[0]
-            languages_to_select = self.lang_features.get(first_feature_name).copy()
-
-            for i in range(1, len(selected_features)):
-                feature_name = selected_features[i]
-                current_feature_langs = self.lang_features.get(feature_name)
-                languages_to_select.intersection_update(current_feature_langs)
-                if not languages_to_select:
-                    break
-
-            for lang_code, var in self.language_vars.items():
-                if lang_code in languages_to_select:
-                    var.set(True)
-                else:
-                    var.set(False)
+        self.select_languages(language_mask)
+
+    def apply_feature_query(self) -> None:
+        """
+        Selects the languages matching the boolean feature query in the query
+        box, e.g. ("No Audible Release" & "Voiced Consonants") | !"Post-Noun Adj.".
+        """
+        query = self.query_var.get().strip()
+        if not query:
+            return
+        try:
+            language_mask = self.query_engine.evaluate(query)
+        except QuerySyntaxError as e:
+            messagebox.showerror("Invalid query", str(e))
+            return
+        self.select_languages(language_mask)
+
+    def select_languages(self, language_mask: Mask) -> None:
+        """
+        Checks exactly the languages in language_mask and updates the map.
+        """
+        language_bits = self.feature_index.language_bits
+        for lang_code, var in self.language_vars.items():
+            var.set(bool(language_mask & language_bits[lang_code]))
+
+        self.schedule_map_update()
+
+    def schedule_map_update(self) -> None:
+        """
+        Requests a map redraw once Tk is idle. Requests arriving before that
+        redraw runs are merged into it and counted in self.redraws_coalesced.
+        """
+        if self.pending_map_update is not None:
+            self.redraws_coalesced += 1
+            return
+        self.pending_map_update = self.after_idle(self.flush_map_update)
 
+    def flush_map_update(self) -> None:
+        """
+        Runs the redraw requested by schedule_map_update.
+        """
+        self.pending_map_update = None
         self.update_map_display()
 
     def update_map_display(self) -> None:
         """
         Updates the visibility of province layers on the canvas based on the
         current state of the language checkboxes (self.language_vars).
+        Only provinces whose visibility changed are touched.
         """
-        provinces_to_show: ProvinceSet = set()
-        for lang_code, var in self.language_vars.items():
-            if var.get():
-                provinces_for_this_language = self.languages.get(lang_code)
-                provinces_to_show.update(provinces_for_this_language)
-
-        for province, item_id in self.province_canvas_items.items():
-            if province in provinces_to_show:
-                self.canvas.itemconfigure(item_id, state="normal")
-                self.canvas.tag_raise(item_id)
-            else:
+        render_started = time.perf_counter()
+        language_mask = self.feature_index.encode_languages(
+            lang_code for lang_code, var in self.language_vars.items() if var.get()
+        )
+        provinces_to_show: ProvinceSet = self.feature_index.decode_provinces(
+            self.feature_index.provinces_for(language_mask)
+        )
+
+        if self.renderer in ("labels", "bundle"):
+            self.map_photo_image.paste(
+                self.map_renderer.render_provinces(provinces_to_show)
+            )
+            self.record_render_time(render_started)
+            return
+
+        if self.renderer == "composite":
+            self.request_composite(provinces_to_show, render_started)
+            return
+
+        if self.lazy_layers:
+            self.ensure_province_layers(provinces_to_show)
+
+        self.apply_province_changes(provinces_to_show)
+        self.record_render_time(render_started)
+
+    def apply_province_changes(self, provinces_to_show: ProvinceSet) -> None:
+        """
+        Hides the layers of provinces that are no longer selected and shows
+        and raises the newly selected ones, leaving every other canvas item
+        untouched.
+        """
+        for province in self.shown_provinces - provinces_to_show:
+            item_id = self.province_canvas_items.get(province)
+            if item_id is not None:
                 self.canvas.itemconfigure(item_id, state="hidden")
+        for province in sorted(provinces_to_show - self.shown_provinces):
+            item_id = self.province_canvas_items[province]
+            self.canvas.itemconfigure(item_id, state="normal")
+            self.canvas.tag_raise(item_id)
+        self.shown_provinces = provinces_to_show
+
+    def request_composite(self, provinces: ProvinceSet, render_started: float) -> None:
+        """
+        Queues a composite of the given provinces on self.render_pool,
+        superseding any render that has not started yet, and polls for the
+        result from the Tk event loop.
+        """
+        if self.pending_render is not None:
+            self.pending_render.cancel()
+        self.pending_render = self.render_pool.submit(
+            self.map_renderer.render_provinces, provinces
+        )
+        self.pending_render_started = render_started
+        self.after(RENDER_POLL_MS, self.poll_composite, self.pending_render)
+
+    def poll_composite(self, future: Future) -> None:
+        """
+        Swaps a finished composite into the map image. Results of renders that
+        were superseded by a newer request are dropped.
+        """
+        if future is not self.pending_render:
+            return
+        if not future.done():
+            self.after(RENDER_POLL_MS, self.poll_composite, future)
+            return
+        self.pending_render = None
+        self.map_photo_image.paste(future.result())
+        self.record_render_time(self.pending_render_started)
+
+    def record_render_time(self, render_started: float) -> None:
+        """
+        When measuring, flushes the pending repaint and records how long the
+        redraw took since render_started.
+        """
+        if not self.measure_renders:
+            return
+        self.update_idletasks()
+        self.render_times.append(time.perf_counter() - render_started)
 
 
 if __name__ == "__main__":
-    app = LanguageMapApp()
+    parser = argparse.ArgumentParser(description="Language Distribution Map Viewer")
+    parser.add_argument(
+        "--renderer",
+        choices=RENDERERS,
+        default="layers",
+        help="how province selections are drawn (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--lazy-layers",
+        action="store_true",
+        help="decode province layers the first time they are shown",
+    )
+    parser.add_argument(
+        "--layer-cache-limit",
+        type=int,
+        default=DEFAULT_LAYER_CACHE_LIMIT,
+        help="hidden layers kept loaded in lazy mode (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--decode-workers",
+        type=int,
+        default=None,
+        help="threads used to decode map images "
+        "(default: Python's thread pool default)",
+    )
+    parser.add_argument(
+        "--measure-renders",
+        action="store_true",
+        help="print redraw latency statistics on exit",
+    )
+    parser.add_argument(
+        "--chart-backend",
+        choices=CHART_BACKENDS,
+        default="native",
+        help="library used to draw feature charts; matplotlib must be installed "
+        "separately (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--chart-kind",
+        choices=CHART_KINDS,
+        default="pie",
+        help="kind of the feature population charts (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--render-cache",
+        default=None,
+        help="directory of a render cache shared with the exporter and server, "
+        "used by the labels and composite renderers",
+    )
+    cli_args = parser.parse_args()
+    if (
+        cli_args.chart_backend == "matplotlib"
+        and importlib.util.find_spec("matplotlib") is None
+    ):
+        parser.error("--chart-backend matplotlib needs matplotlib to be installed")
+
+    app = LanguageMapApp(
+        renderer=cli_args.renderer,
+        lazy_layers=cli_args.lazy_layers,
+        layer_cache_limit=cli_args.layer_cache_limit,
+        decode_workers=cli_args.decode_workers,
+        measure_renders=cli_args.measure_renders,
+        chart_backend=cli_args.chart_backend,
+        chart_kind=cli_args.chart_kind,
+        render_cache=cli_args.render_cache,
+    )
     app.mainloop()
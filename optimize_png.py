@@ -0,0 +1,194 @@
+"""
+Build-time optimizer for the PNGs in ./map.
+
+The province layers are stored as full-frame 8-bit RGBA of about 265 KB
+each, but the viewer only ever uses their highlighted pixels, through
+layers.decode_layer and layers.highlight_mask. With --highlight-only each
+layer is therefore reduced to those pixels, with everything else fully
+transparent, which leaves a flat fill with antialiased edges; the layers then
+no longer show the rest of the map when opened on their own.
+
+By default every image keeps all its pixels. That saves almost nothing on the
+current ./map (a dry run reports 8.50 MB -> 8.50 MB), since the layers have
+thousands of colours and are already well compressed; the size savings
+(8.50 MB -> 0.44 MB) come from --highlight-only.
+
+Every image is encoded as an exact palette image when it has at most 256
+colours (1-bit when it has two) and in its own mode otherwise, without
+metadata and at the maximum compression level. Each candidate is decoded
+again and only replaces the original if it decodes to the same pixels and is
+smaller. The colour of fully transparent pixels is not considered part of
+the image.
+
+    python optimize_png.py --dry-run
+    python optimize_png.py --highlight-only
+"""
+
+import argparse
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from labels import LABELS_FILENAME, find_layer_filenames
+from layers import BACKGROUND_FILENAME, highlight_mask, isolate_highlight
+
+
+FilePath = str
+
+MAX_PALETTE_COLORS = 256
+
+
+def visible_pixels(img: Image.Image) -> Image.Image:
+    """
+    Returns img as RGBA with every fully transparent pixel set to
+    (0, 0, 0, 0).
+    """
+    rgba = np.array(img.convert("RGBA"), dtype=np.uint8)
+    rgba[rgba[..., 3] == 0] = 0
+    return Image.fromarray(rgba)
+
+
+def layer_pixels(img: Image.Image) -> Image.Image:
+    """
+    Returns the pixels of a province layer that the viewer uses: the
+    highlighted province on transparency.
+    """
+    return visible_pixels(isolate_highlight(img.convert("RGBA")))
+
+
+def exact_palette(img: Image.Image) -> Optional[Image.Image]:
+    """
+    Returns img as a "P" image whose palette holds exactly its colours, with
+    alpha only if some are not opaque, or None if it has more than
+    MAX_PALETTE_COLORS of them.
+    """
+    rgba = np.ascontiguousarray(np.asarray(img.convert("RGBA"), dtype=np.uint8))
+    packed = rgba.view(np.uint32).reshape(-1)
+    colors, indices = np.unique(packed, return_inverse=True)
+    if len(colors) > MAX_PALETTE_COLORS:
+        return None
+    paletted = Image.frombytes("P", img.size, indices.astype(np.uint8).tobytes())
+    palette = colors.view(np.uint8).reshape(-1, 4)
+    if (palette[:, 3] == 255).all():
+        paletted.putpalette(palette[:, :3].tobytes())
+    else:
+        paletted.putpalette(palette.tobytes(), rawmode="RGBA")
+    return paletted
+
+
+def encode_png(img: Image.Image) -> bytes:
+    """
+    Encodes img as a PNG at the maximum compression level, with no metadata.
+    """
+    out = io.BytesIO()
+    img.save(out, "PNG", optimize=True, compress_level=9)
+    return out.getvalue()
+
+
+def optimize_file(
+    filepath: FilePath, highlight_only: bool, dry_run: bool = False
+) -> Tuple[FilePath, int, int]:
+    """
+    Replaces filepath with its smallest equivalent encoding, unless dry_run,
+    and returns the path with its size before and after. With highlight_only
+    the file is a province layer of which only the highlight must survive.
+    """
+    with open(filepath, "rb") as f:
+        original = f.read()
+    with Image.open(io.BytesIO(original)) as img:
+        img.load()
+    view: Callable[[Image.Image], Image.Image] = (
+        layer_pixels if highlight_only else visible_pixels
+    )
+    viewed = view(img)
+    expected = viewed.tobytes()
+    expected_mask = highlight_mask(viewed).tobytes() if highlight_only else b""
+    pixels = viewed if highlight_only or img.mode == "RGBA" else img
+
+    best = original
+    for candidate in (exact_palette(pixels), pixels):
+        if candidate is None:
+            continue
+        encoded = encode_png(candidate)
+        if len(encoded) >= len(best):
+            continue
+        with Image.open(io.BytesIO(encoded)) as png:
+            decoded = png.convert("RGBA")
+        if view(decoded).tobytes() != expected:
+            continue
+        if highlight_only and highlight_mask(decoded).tobytes() != expected_mask:
+            continue
+        best = encoded
+
+    if best is not original and not dry_run:
+        temp_filepath = filepath + ".tmp"
+        with open(temp_filepath, "wb") as f:
+            f.write(best)
+        os.replace(temp_filepath, filepath)
+    return filepath, len(original), len(best)
+
+
+def optimize_all(
+    layer_filenames: List[FilePath],
+    other_filenames: List[FilePath],
+    highlight_only: bool = False,
+    dry_run: bool = False,
+    workers: Optional[int] = None,
+) -> Tuple[int, int]:
+    """
+    Optimizes the layers and the other images on a pool of worker processes,
+    printing each result, and returns the total size before and after. With
+    highlight_only the layers keep only their highlighted pixels.
+    """
+    jobs = [(filepath, highlight_only) for filepath in layer_filenames]
+    jobs += [(filepath, False) for filepath in other_filenames]
+    before = after = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(optimize_file, filepath, layer_only, dry_run)
+            for filepath, layer_only in jobs
+        ]
+        for future in futures:
+            filepath, original_size, optimized_size = future.result()
+            before += original_size
+            after += optimized_size
+            print(f"{filepath}: {original_size} -> {optimized_size} bytes")
+    print(f"{len(jobs)} files, {before} -> {after} bytes")
+    return before, after
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optimize the map PNGs")
+    parser.add_argument(
+        "--highlight-only",
+        action="store_true",
+        help="reduce the layers to their highlighted pixels instead of keeping "
+        "every pixel",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="report the sizes that would be reached without writing anything",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes (default: one per core)",
+    )
+    cli_args = parser.parse_args()
+
+    others = [BACKGROUND_FILENAME]
+    if os.path.exists(LABELS_FILENAME):
+        others.append(LABELS_FILENAME)
+    optimize_all(
+        list(find_layer_filenames().values()),
+        others,
+        cli_args.highlight_only,
+        cli_args.dry_run,
+        cli_args.workers,
+    )
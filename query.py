@@ -0,0 +1,455 @@
+"""
+Bitmask index over the language, feature and province tables.
+
+Languages and provinces are assigned bit positions in sorted order, so a set
+of languages or provinces is a single Python int. Each feature stores the
+mask of languages that have it and each language the mask of provinces where
+it is spoken, which turns feature intersection and province lookup into a
+handful of integer AND/OR operations.
+
+Feature queries such as ("No Audible Release" & "Voiced Consonants") |
+!"Post-Noun Adj." are parsed into a normalized tree and evaluated over these
+masks by a QueryEngine that memoizes every subexpression.
+
+A FeatureLattice precomputes the language and province masks of every subset
+of features, so a checkbox selection is answered with one table lookup.
+"""
+
+import json
+import os
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+ProvinceName = str
+LanguageCode = str
+FeatureName = str
+LanguageDict = Dict[LanguageCode, Set[ProvinceName]]
+FeatureDict = Dict[FeatureName, Set[LanguageCode]]
+Mask = int
+LatticeEntry = Tuple[Mask, Mask]
+QueryNode = Tuple[str, Union[str, "QueryNode", Tuple["QueryNode", ...]]]
+
+
+def iter_bits(mask: Mask) -> Iterator[int]:
+    """
+    Yields the positions of the set bits of mask in ascending order.
+    """
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+class FeatureIndex:
+    """
+    Compiled bitmask form of the languages and lang_features tables.
+    """
+
+    def __init__(self, languages: LanguageDict, lang_features: FeatureDict):
+        self.language_codes: List[LanguageCode] = sorted(languages)
+        self.feature_names: List[FeatureName] = sorted(lang_features)
+        self.provinces: List[ProvinceName] = sorted(set().union(*languages.values()))
+        self.language_bits: Dict[LanguageCode, Mask] = {
+            code: 1 << i for i, code in enumerate(self.language_codes)
+        }
+        self.province_bits: Dict[ProvinceName, Mask] = {
+            province: 1 << i for i, province in enumerate(self.provinces)
+        }
+        self.all_languages: Mask = (1 << len(self.language_codes)) - 1
+        self.feature_masks: Dict[FeatureName, Mask] = {
+            name: self.encode_languages(codes) for name, codes in lang_features.items()
+        }
+        self.language_province_masks: List[Mask] = [
+            self.encode_provinces(languages[code]) for code in self.language_codes
+        ]
+
+    def encode_languages(self, codes: Iterable[LanguageCode]) -> Mask:
+        """
+        Returns the mask of the given language codes.
+        """
+        mask = 0
+        for code in codes:
+            mask |= self.language_bits[code]
+        return mask
+
+    def encode_provinces(self, provinces: Iterable[ProvinceName]) -> Mask:
+        """
+        Returns the mask of the given provinces.
+        """
+        mask = 0
+        for province in provinces:
+            mask |= self.province_bits[province]
+        return mask
+
+    def decode_languages(self, mask: Mask) -> Set[LanguageCode]:
+        """
+        Returns the language codes whose bits are set in mask.
+        """
+        return {self.language_codes[i] for i in iter_bits(mask)}
+
+    def decode_provinces(self, mask: Mask) -> Set[ProvinceName]:
+        """
+        Returns the provinces whose bits are set in mask.
+        """
+        return {self.provinces[i] for i in iter_bits(mask)}
+
+    def languages_with_all(self, features: Iterable[FeatureName]) -> Mask:
+        """
+        Returns the mask of languages that have every one of the features.
+        No features selects every language.
+        """
+        mask = self.all_languages
+        for name in features:
+            mask &= self.feature_masks[name]
+            if not mask:
+                break
+        return mask
+
+    def provinces_for(self, language_mask: Mask) -> Mask:
+        """
+        Returns the mask of provinces where any language in language_mask is
+        spoken.
+        """
+        mask = 0
+        for i in iter_bits(language_mask):
+            mask |= self.language_province_masks[i]
+        return mask
+
+
+LATTICE_FILENAME = "./feature_lattice.json"
+LATTICE_EAGER_LIMIT = 12
+
+
+class FeatureLattice:
+    """
+    The language mask (languages having every feature) and province mask of
+    each subset of features, keyed by the subset's feature mask. With up to
+    LATTICE_EAGER_LIMIT features every subset is computed up front; larger
+    lattices are filled in lazily as subsets are looked up.
+    """
+
+    def __init__(self, index: FeatureIndex, eager: Optional[bool] = None):
+        self.index = index
+        self.feature_bits: Dict[FeatureName, Mask] = {
+            name: 1 << i for i, name in enumerate(index.feature_names)
+        }
+        self.entries: Dict[Mask, LatticeEntry] = {
+            0: (index.all_languages, index.provinces_for(index.all_languages))
+        }
+        if eager is None:
+            eager = len(index.feature_names) <= LATTICE_EAGER_LIMIT
+        if eager:
+            self.materialize()
+
+    def encode_features(self, names: Iterable[FeatureName]) -> Mask:
+        """
+        Returns the feature mask of the given feature names.
+        """
+        mask = 0
+        for name in names:
+            mask |= self.feature_bits[name]
+        return mask
+
+    def lookup(self, feature_mask: Mask) -> LatticeEntry:
+        """
+        Returns the (language mask, province mask) of a feature subset,
+        computing and memoizing it from its smaller subsets if needed.
+        """
+        entry = self.entries.get(feature_mask)
+        if entry is None:
+            lowest = feature_mask & -feature_mask
+            name = self.index.feature_names[lowest.bit_length() - 1]
+            rest_languages = self.lookup(feature_mask ^ lowest)[0]
+            entry = self.make_entry(rest_languages & self.index.feature_masks[name])
+            self.entries[feature_mask] = entry
+        return entry
+
+    def make_entry(self, language_mask: Mask) -> LatticeEntry:
+        """
+        Pairs a language mask with the mask of provinces it covers.
+        """
+        return (language_mask, self.index.provinces_for(language_mask))
+
+    def materialize(self) -> None:
+        """
+        Computes every subset in increasing order, so each one is derived
+        from an already known subset with a single AND.
+        """
+        feature_masks = [self.index.feature_masks[n] for n in self.index.feature_names]
+        for feature_mask in range(1, 1 << len(feature_masks)):
+            if feature_mask in self.entries:
+                continue
+            lowest = feature_mask & -feature_mask
+            rest_languages = self.entries[feature_mask ^ lowest][0]
+            language_mask = rest_languages & feature_masks[lowest.bit_length() - 1]
+            self.entries[feature_mask] = self.make_entry(language_mask)
+
+    def save(self, filename: str = LATTICE_FILENAME) -> None:
+        """
+        Writes the computed entries together with the bit order they use,
+        replacing filename only once the new file is complete.
+        """
+        data = {
+            "languages": self.index.language_codes,
+            "features": self.index.feature_names,
+            "provinces": self.index.provinces,
+            "feature_masks": self.index.feature_masks,
+            "entries": sorted([s, *entry] for s, entry in self.entries.items()),
+        }
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_filename, filename)
+
+    @classmethod
+    def load(
+        cls, index: FeatureIndex, filename: str = LATTICE_FILENAME
+    ) -> "FeatureLattice":
+        """
+        Returns the lattice saved in filename if it was built from the same
+        tables as index, and a freshly computed lattice otherwise, including
+        when the file is missing, truncated or malformed.
+        """
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if (
+                data["languages"] != index.language_codes
+                or data["features"] != index.feature_names
+                or data["provinces"] != index.provinces
+                or data["feature_masks"] != index.feature_masks
+            ):
+                return cls(index)
+            lattice = cls(index, eager=False)
+            for feature_mask, language_mask, province_mask in data["entries"]:
+                lattice.entries[feature_mask] = (language_mask, province_mask)
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls(index)
+        return lattice
+
+
+class QuerySyntaxError(ValueError):
+    """
+    Raised for feature queries that cannot be parsed or name unknown features.
+    """
+
+
+TOKEN_OPERATORS = {"&", "|", "!", "(", ")"}
+
+
+def tokenize_query(text: str) -> List[str]:
+    """
+    Splits a feature query into operator tokens and quoted feature names.
+    Feature names are returned with their surrounding double quotes.
+    """
+    tokens = []
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char.isspace():
+            i += 1
+        elif char in TOKEN_OPERATORS:
+            tokens.append(char)
+            i += 1
+        elif char == '"':
+            name = []
+            i += 1
+            while i < len(text) and text[i] != '"':
+                if text[i] == "\\" and i + 1 < len(text):
+                    i += 1
+                name.append(text[i])
+                i += 1
+            if i == len(text):
+                raise QuerySyntaxError("unterminated feature name")
+            tokens.append('"' + "".join(name) + '"')
+            i += 1
+        else:
+            raise QuerySyntaxError(f"unexpected character {char!r} at {i}")
+    return tokens
+
+
+def parse_query(text: str) -> QueryNode:
+    """
+    Parses a query such as ("A" & "B") | !"C" into a normalized tree.
+    ! binds tighter than &, which binds tighter than |.
+    """
+    tokens = tokenize_query(text)
+    position = 0
+
+    def peek() -> Optional[str]:
+        return tokens[position] if position < len(tokens) else None
+
+    def take() -> str:
+        nonlocal position
+        token = peek()
+        if token is None:
+            raise QuerySyntaxError("unexpected end of query")
+        position += 1
+        return token
+
+    def parse_or() -> QueryNode:
+        children = [parse_and()]
+        while peek() == "|":
+            take()
+            children.append(parse_and())
+        return make_node("or", children)
+
+    def parse_and() -> QueryNode:
+        children = [parse_not()]
+        while peek() == "&":
+            take()
+            children.append(parse_not())
+        return make_node("and", children)
+
+    def parse_not() -> QueryNode:
+        token = take()
+        if token == "!":
+            return make_node("not", [parse_not()])
+        if token == "(":
+            node = parse_or()
+            if take() != ")":
+                raise QuerySyntaxError("expected )")
+            return node
+        if token.startswith('"'):
+            return ("feature", token[1:-1])
+        raise QuerySyntaxError(f"unexpected {token!r}")
+
+    node = parse_or()
+    if peek() is not None:
+        raise QuerySyntaxError(f"unexpected {peek()!r}")
+    return node
+
+
+def make_node(op: str, children: List[QueryNode]) -> QueryNode:
+    """
+    Builds a normalized node: nested and/or nodes are flattened, duplicate
+    operands removed and operands sorted, and double negation is dropped, so
+    equivalent spellings of a query share one canonical form.
+    """
+    if op == "not":
+        child = children[0]
+        return child[1] if child[0] == "not" else ("not", child)
+    operands: Set[QueryNode] = set()
+    for child in children:
+        if child[0] == op:
+            operands.update(child[1])
+        else:
+            operands.add(child)
+    if len(operands) == 1:
+        return operands.pop()
+    return (op, tuple(sorted(operands, key=format_query)))
+
+
+def format_query(node: QueryNode) -> str:
+    """
+    Returns the canonical text of a normalized query node.
+    """
+    op = node[0]
+    if op == "feature":
+        return '"' + node[1].replace("\\", "\\\\").replace('"', '\\"') + '"'
+    if op == "not":
+        return "!" + format_query(node[1])
+    joiner = " & " if op == "and" else " | "
+    return "(" + joiner.join(format_query(child) for child in node[1]) + ")"
+
+
+class QueryEngine:
+    """
+    Evaluates feature queries against a FeatureIndex. Every query is parsed
+    once into a compiled evaluator that computes the language mask for all
+    languages at once, and the mask of every subexpression is memoized under
+    its canonical form so queries that share parts reuse each other's work.
+    """
+
+    def __init__(self, index: FeatureIndex):
+        self.index = index
+        self.parsed: Dict[str, QueryNode] = {}
+        self.evaluators: Dict[QueryNode, Callable[[], Mask]] = {}
+        self.results: Dict[QueryNode, Mask] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, text: str) -> QueryNode:
+        """
+        Returns the normalized tree of a query, parsing each text only once.
+        """
+        node = self.parsed.get(text)
+        if node is None:
+            node = parse_query(text)
+            self.parsed[text] = node
+        return node
+
+    def evaluate(self, text: str) -> Mask:
+        """
+        Returns the mask of languages matching a query.
+        """
+        return self.evaluate_node(self.parse(text))
+
+    def evaluate_node(self, node: QueryNode) -> Mask:
+        """
+        Returns the memoized mask of a normalized node, compiling and running
+        its evaluator on first use.
+        """
+        if node in self.results:
+            self.hits += 1
+            return self.results[node]
+        self.misses += 1
+        mask = self.evaluator(node)()
+        self.results[node] = mask
+        return mask
+
+    def evaluator(self, node: QueryNode) -> Callable[[], Mask]:
+        """
+        Returns the compiled evaluator of a normalized node.
+        """
+        evaluator = self.evaluators.get(node)
+        if evaluator is None:
+            evaluator = self.compile(node)
+            self.evaluators[node] = evaluator
+        return evaluator
+
+    def compile(self, node: QueryNode) -> Callable[[], Mask]:
+        """
+        Turns a normalized node into a function returning its language mask.
+        """
+        op = node[0]
+        if op == "feature":
+            if node[1] not in self.index.feature_masks:
+                raise QuerySyntaxError(f"unknown feature {node[1]!r}")
+            mask = self.index.feature_masks[node[1]]
+            return lambda: mask
+        if op == "not":
+            child = node[1]
+            self.evaluator(child)
+            all_languages = self.index.all_languages
+            return lambda: all_languages & ~self.evaluate_node(child)
+        children = node[1]
+        for child in children:
+            self.evaluator(child)
+        if op == "and":
+
+            def evaluate_and() -> Mask:
+                mask = self.index.all_languages
+                for child in children:
+                    mask &= self.evaluate_node(child)
+                    if not mask:
+                        break
+                return mask
+
+            return evaluate_and
+
+        def evaluate_or() -> Mask:
+            mask = 0
+            for child in children:
+                mask |= self.evaluate_node(child)
+            return mask
+
+        return evaluate_or
+
+
+if __name__ == "__main__":
+    from language_data import LANG_FEATURES, LANGUAGES
+
+    feature_lattice = FeatureLattice(FeatureIndex(LANGUAGES, LANG_FEATURES), eager=True)
+    feature_lattice.save()
+    print(f"Wrote {len(feature_lattice.entries)} subsets to {LATTICE_FILENAME}")
@@ -0,0 +1,272 @@
+"""
+Rasterizes the cleaned province SVGs into cropped province masks.
+
+Every province is rendered from the cleaned base plus delta store (see
+svgstore.py) at the size of the map canvas times a scale factor. Only the
+highlighted province is kept: each mask is cropped to its bounding box and
+written as a 1-bit PNG, and masks.json records the canvas size and every
+bounding box, so no full-frame transparent image is ever stored. The
+background is rendered from the base without any delta. Provinces are
+rendered on a process pool. MapRenderer reads its layers from the masks
+through MaskLayers whenever masks.json exists.
+
+Rendering needs cairosvg and the cairo library, which are imported only when
+a file is rasterized.
+
+    python rasterize.py --scale 2
+"""
+
+import argparse
+import io
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from labels import HIGHLIGHT_COLOR, Color
+from layers import CroppedLayer, decode_layer, highlight_mask
+from svgstore import (
+    CLEANED_BASE_FILENAME,
+    CLEANED_DELTAS_FILENAME,
+    STORE_DIRECTORY,
+    clean_store,
+    extract,
+    load_deltas,
+)
+
+
+ProvinceName = str
+FilePath = str
+BoundingBox = Tuple[int, int, int, int]
+MaskJob = Tuple[ProvinceName, FilePath, FilePath, Tuple[int, int]]
+
+MASKS_DIRECTORY = "./map/masks"
+MASKS_INDEX_FILENAME = "masks.json"
+MASK_BACKGROUND_FILENAME = "background.png"
+
+
+def svg_size(filepath: FilePath) -> Tuple[float, float]:
+    """
+    Returns the width and height of an SVG's root element, reading no
+    further than its start tag.
+    """
+    for _, element in ET.iterparse(filepath, events=("start",)):
+        return float(element.get("width")), float(element.get("height"))
+    raise ValueError(f"{filepath} has no root element")
+
+
+def rasterize_svg(svg: bytes, size: Tuple[int, int]) -> Image.Image:
+    """
+    Renders an SVG document to an RGBA image of the given size.
+    """
+    try:
+        import cairosvg  # type: ignore
+    except (ImportError, OSError) as e:
+        raise RuntimeError(
+            "rasterizing SVGs needs cairosvg and the cairo library "
+            "(pip install cairosvg)"
+        ) from e
+    png = cairosvg.svg2png(bytestring=svg, output_width=size[0], output_height=size[1])
+    with Image.open(io.BytesIO(png)) as img:
+        return img.convert("RGBA")
+
+
+def province_svg(province: Optional[ProvinceName], store: FilePath) -> bytes:
+    """
+    Returns the cleaned SVG of a province, or of the bare base for None.
+    """
+    if province is None:
+        with open(os.path.join(store, CLEANED_BASE_FILENAME), encoding="utf-8") as f:
+            return f.read().encode()
+    out = io.StringIO()
+    extract(province, out, cleaned=True, directory=store)
+    return out.getvalue().encode()
+
+
+def canvas_size(base: FilePath, scale: float = 1.0) -> Tuple[int, int]:
+    """
+    Returns the pixel size the SVGs are rendered at for a scale.
+    """
+    width, height = svg_size(base)
+    return round(width * scale), round(height * scale)
+
+
+def write_mask(
+    svg: bytes, size: Tuple[int, int], filepath: FilePath
+) -> Optional[BoundingBox]:
+    """
+    Renders an SVG, writes the 1-bit mask of its highlight cropped to its
+    bounding box and returns the box, or None without writing anything if
+    nothing is highlighted.
+    """
+    mask = highlight_mask(rasterize_svg(svg, size))
+    bbox = mask.getbbox()
+    if bbox is not None:
+        mask.crop(bbox).convert("1", dither=Image.Dither.NONE).save(
+            filepath, "PNG", optimize=True
+        )
+    return bbox
+
+
+def mask_index(
+    size: Tuple[int, int], scale: float, bboxes: Dict[ProvinceName, BoundingBox]
+) -> Dict[str, Any]:
+    """
+    Returns the contents of masks.json for the given bounding boxes.
+    """
+    return {
+        "size": list(size),
+        "scale": scale,
+        "background": MASK_BACKGROUND_FILENAME,
+        "provinces": {
+            province: {"file": f"{province}.png", "bbox": list(bboxes[province])}
+            for province in sorted(bboxes)
+        },
+    }
+
+
+def rasterize_province(job: MaskJob) -> Tuple[ProvinceName, Optional[BoundingBox]]:
+    """
+    Renders one province in a worker process, writes its cropped 1-bit mask
+    and returns its bounding box, or None if nothing is highlighted.
+    """
+    province, store, output_directory, size = job
+    filepath = os.path.join(output_directory, f"{province}.png")
+    return province, write_mask(province_svg(province, store), size, filepath)
+
+
+def rasterize_all(
+    store: FilePath = STORE_DIRECTORY,
+    output_directory: FilePath = MASKS_DIRECTORY,
+    scale: float = 1.0,
+    workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Rasterizes the background and every province of the store into
+    output_directory and writes and returns the mask index.
+    """
+    if not os.path.exists(os.path.join(store, CLEANED_DELTAS_FILENAME)):
+        clean_store(directory=store)
+    size = canvas_size(os.path.join(store, CLEANED_BASE_FILENAME), scale)
+    provinces = sorted(load_deltas(os.path.join(store, CLEANED_DELTAS_FILENAME)))
+    os.makedirs(output_directory, exist_ok=True)
+
+    started = time.perf_counter()
+    rasterize_svg(province_svg(None, store), size).save(
+        os.path.join(output_directory, MASK_BACKGROUND_FILENAME), optimize=True
+    )
+    jobs: List[MaskJob] = [
+        (province, store, output_directory, size) for province in provinces
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        bboxes = dict(pool.map(rasterize_province, jobs))
+    print(
+        f"Rasterized {len(jobs)} provinces at {size[0]}x{size[1]} "
+        f"in {time.perf_counter() - started:.1f} s"
+    )
+
+    index = mask_index(
+        size,
+        scale,
+        {province: bbox for province, bbox in bboxes.items() if bbox is not None},
+    )
+    with open(
+        os.path.join(output_directory, MASKS_INDEX_FILENAME), "w", encoding="utf-8"
+    ) as f:
+        json.dump(index, f, indent=4)
+    return index
+
+
+class MaskLayers:
+    """
+    Province layers read from rasterized masks instead of full-frame PNGs.
+    Each province is its cropped 1-bit mask filled with color, placed at the
+    top-left corner of its bounding box from masks.json, in the
+    (image, offset) form produced by layers.decode_layer.
+    """
+
+    def __init__(
+        self,
+        directory: FilePath,
+        index: Dict[str, Any],
+        color: Color = HIGHLIGHT_COLOR,
+    ):
+        self.directory = directory
+        self.size: Tuple[int, int] = tuple(index["size"])
+        self.color = color
+        self.filenames: Dict[ProvinceName, FilePath] = {}
+        self.bboxes: Dict[FilePath, BoundingBox] = {}
+        for province, entry in index["provinces"].items():
+            filepath = os.path.join(directory, entry["file"])
+            self.filenames[province] = filepath
+            self.bboxes[filepath] = tuple(entry["bbox"])
+
+    @classmethod
+    def load(
+        cls,
+        directory: FilePath = MASKS_DIRECTORY,
+        size: Optional[Tuple[int, int]] = None,
+    ) -> Optional["MaskLayers"]:
+        """
+        Returns the masks rasterized into directory, or None if there is no
+        readable masks.json or the masks were rendered at another size.
+        """
+        try:
+            with open(
+                os.path.join(directory, MASKS_INDEX_FILENAME), encoding="utf-8"
+            ) as f:
+                layers = cls(directory, json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if size is not None and layers.size != tuple(size):
+            return None
+        return layers
+
+    def index_filename(self) -> FilePath:
+        """
+        Returns the path of the masks.json the layers were read from.
+        """
+        return os.path.join(self.directory, MASKS_INDEX_FILENAME)
+
+    def decode(self, filepath: FilePath) -> CroppedLayer:
+        """
+        Decodes the mask at filepath into a cropped layer. Files that are not
+        one of the masks are decoded as full-frame layer PNGs.
+        """
+        bbox = self.bboxes.get(filepath)
+        if bbox is None:
+            return decode_layer(filepath)
+        x0, y0, x1, y1 = bbox
+        with Image.open(filepath) as mask:
+            layer = Image.new("RGBA", (x1 - x0, y1 - y0), self.color)
+            layer.putalpha(mask.convert("L"))
+        return layer, (x0, y0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rasterize province masks")
+    parser.add_argument(
+        "--store", default=STORE_DIRECTORY, help="(default: %(default)s)"
+    )
+    parser.add_argument(
+        "--output", default=MASKS_DIRECTORY, help="(default: %(default)s)"
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="multiple of the SVG canvas size to render at (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes (default: one per core)",
+    )
+    cli_args = parser.parse_args()
+
+    rasterize_all(cli_args.store, cli_args.output, cli_args.scale, cli_args.workers)
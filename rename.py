@@ -1,6 +1,8 @@
+from asset_files import install_file, province_name
+
 with open("filename.txt", "r") as f:
     filenames = f.readlines()
 
 for file in filenames:
-    with open(f"./map/{file.strip()}_cleaned.png", "rb") as p:
-        open(f"./map/{file.strip().split("_")[0]}.png", "wb").write(p.read())
\ No newline at end of file
+    province = province_name(file.strip())
+    install_file(f"./map/{file.strip()}_cleaned.png", f"./map/{province}.png")
@@ -0,0 +1,201 @@
+"""
+Content-addressed disk cache of rendered map PNGs, shared by the viewer, the
+exporter and the server.
+
+A map is stored under the SHA-256 of its sorted province set, its style (the
+render backend and anything else that changes pixels) and a hash of the
+source files it was rendered from, so regenerating a layer never serves a
+stale map. The total size is capped; the least recently used maps are
+deleted first. Several threads and processes may use the same directory at
+once: files are written atomically and eviction tolerates files that vanish
+under it.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from lru import LRUCache
+
+
+ProvinceName = str
+FilePath = str
+CacheKey = str
+Style = Dict[str, Any]
+
+DEFAULT_RENDER_CACHE_DIR = "./.render_cache"
+DEFAULT_RENDER_CACHE_BYTES = 256 * 1024 * 1024
+SOURCES_FILENAME = "sources.json"
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_sha256(filepath: FilePath) -> str:
+    """
+    Returns the SHA-256 of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """
+    A directory of PNGs named by cache key, with at most max_bytes in total.
+    """
+
+    def __init__(
+        self,
+        directory: FilePath = DEFAULT_RENDER_CACHE_DIR,
+        max_bytes: int = DEFAULT_RENDER_CACHE_BYTES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.entries: LRUCache[FilePath, int] = LRUCache()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.scan()
+
+    def scan(self) -> None:
+        """
+        Rebuilds the in-memory view of the directory, oldest files first, so
+        files written by other processes are accounted for.
+        """
+        with self.lock:
+            self.scan_locked()
+
+    def scan_locked(self) -> None:
+        """
+        Does the work of scan() while self.lock is held.
+        """
+        found: List[Tuple[int, FilePath, int]] = []
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".png"):
+                    continue
+                filepath = os.path.join(root, filename)
+                try:
+                    stat = os.stat(filepath)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime_ns, filepath, stat.st_size))
+        self.entries.clear()
+        for _, filepath, size in sorted(found):
+            self.entries.put(filepath, size)
+        self.total_bytes = sum(size for _, _, size in found)
+
+    def source_hash(self, filepaths: Iterable[FilePath]) -> str:
+        """
+        Returns a hash of the contents of the source files. File hashes are
+        remembered in the cache directory by size and modification time, so
+        unchanged files are not read again.
+        """
+        known_path = os.path.join(self.directory, SOURCES_FILENAME)
+        try:
+            with open(known_path, "r", encoding="utf-8") as f:
+                known: Dict[str, List[Any]] = json.load(f)
+        except (FileNotFoundError, ValueError):
+            known = {}
+
+        digest = hashlib.sha256()
+        changed = False
+        for filepath in sorted(filepaths):
+            stat = os.stat(filepath)
+            key = os.path.abspath(filepath)
+            size, mtime_ns, file_hash = known.get(key, (None, None, None))
+            if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                file_hash = file_sha256(filepath)
+                known[key] = [stat.st_size, stat.st_mtime_ns, file_hash]
+                changed = True
+            digest.update(f"{filepath}:{file_hash};".encode())
+
+        if changed:
+            self.write_atomic(known_path, json.dumps(known).encode())
+        return digest.hexdigest()
+
+    def key(
+        self, provinces: Iterable[ProvinceName], style: Style, source_hash: str
+    ) -> CacheKey:
+        """
+        Returns the cache key of a map.
+        """
+        data = {"provinces": sorted(provinces), "style": style, "sources": source_hash}
+        encoded = json.dumps(data, sort_keys=True).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def path(self, key: CacheKey) -> FilePath:
+        """
+        Returns where the map with a cache key is stored.
+        """
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        """
+        Returns the cached PNG for key, or None, and marks it recently used.
+        """
+        filepath = self.path(key)
+        with self.lock:
+            try:
+                with open(filepath, "rb") as f:
+                    png = f.read()
+                os.utime(filepath)
+            except FileNotFoundError:
+                self.misses += 1
+                size = self.entries.pop(filepath)
+                self.total_bytes -= size or 0
+                return None
+            self.hits += 1
+            if self.entries.get(filepath) is None:
+                self.entries.put(filepath, len(png))
+                self.total_bytes += len(png)
+            return png
+
+    def put(self, key: CacheKey, png: bytes) -> None:
+        """
+        Stores a PNG under key and evicts the least recently used maps if the
+        cache has grown past max_bytes.
+        """
+        filepath = self.path(key)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        self.write_atomic(filepath, png)
+        with self.lock:
+            previous = self.entries.pop(filepath)
+            self.entries.put(filepath, len(png))
+            self.total_bytes += len(png) - (previous or 0)
+            if self.total_bytes > self.max_bytes:
+                self.scan_locked()
+                self.evict()
+
+    def evict(self) -> None:
+        """
+        Deletes the least recently used maps until the cache fits max_bytes.
+        Must be called with self.lock held.
+        """
+        while self.total_bytes > self.max_bytes and len(self.entries):
+            filepath = next(iter(self.entries))
+            self.total_bytes -= self.entries.pop(filepath)
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                pass
+
+    def write_atomic(self, filepath: FilePath, data: bytes) -> None:
+        """
+        Writes data to a temporary file next to filepath and renames it into
+        place, so readers never see a partially written file.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, filepath)
+        except BaseException:
+            os.remove(temp_path)
+            raise
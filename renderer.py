@@ -0,0 +1,339 @@
+"""
+Headless map rendering: turns a language selection, a set of features or a
+feature query into a map image without Tk.
+
+The viewer in main.py is a thin client of MapRenderer, and the same core can
+render maps from batch jobs and server processes. Given a RenderCache, maps
+are looked up on disk before they are rendered. Run this module to write a
+single map to a PNG file.
+"""
+
+import argparse
+import io
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from PIL import Image
+
+from bundle import BUNDLE_FILENAME, AssetBundle, build_bundle, bundle_is_current
+from compositor import LayerCompositor
+from labels import (
+    LABELS_FILENAME,
+    LABELS_INDEX_FILENAME,
+    LabelRaster,
+    find_layer_filenames,
+)
+from language_data import LANG_FEATURES, LANGUAGES, FeatureDict, LanguageDict
+from layers import (
+    BACKGROUND_FILENAME,
+    MAP_DIRECTORY,
+    decode_image,
+    decode_layer,
+    layer_filename,
+)
+from query import FeatureIndex, FeatureLattice, Mask, QueryEngine
+from rasterize import MASKS_DIRECTORY, MASKS_INDEX_FILENAME, MaskLayers
+from render_cache import DEFAULT_RENDER_CACHE_DIR, RenderCache, Style
+
+
+ProvinceName = str
+LanguageCode = str
+FeatureName = str
+FilePath = str
+ProvinceSet = Set[ProvinceName]
+LayerDict = Dict[ProvinceName, FilePath]
+Decoder = Callable[[FilePath], Any]
+DecodeFunction = Callable[[FilePath, Decoder], Any]
+
+RENDER_BACKENDS = ("composite", "labels", "bundle")
+
+
+def encode_png(image: Image.Image) -> bytes:
+    """
+    Encodes a Pillow image as PNG bytes.
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def decode_now(filepath: FilePath, decoder: Decoder) -> Any:
+    """
+    Decodes a file on the calling thread.
+    """
+    return decoder(filepath)
+
+
+def find_mask_layers(directory: FilePath = MASKS_DIRECTORY) -> Optional[MaskLayers]:
+    """
+    Returns the rasterized masks in directory if they exist and were rendered
+    at the size of the background map.
+    """
+    if not os.path.exists(os.path.join(directory, MASKS_INDEX_FILENAME)):
+        return None
+    with Image.open(BACKGROUND_FILENAME) as background:
+        return MaskLayers.load(directory, background.size)
+
+
+class MapRenderer:
+    """
+    Resolves selections to provinces with the bitmask index and renders them
+    over the background map, either by alpha-blending the cropped province
+    layers ("composite"), from the province label raster ("labels") or from
+    the masks of the memory-mapped asset bundle ("bundle").
+
+    Layers are decoded the first time a province is rendered, from the
+    rasterized masks in mask_directory when they exist and match the size of
+    the background, and from the layer PNGs otherwise. All methods may be
+    called from any thread.
+
+    With a cache, every map is first looked up in the RenderCache by its
+    provinces, self.style() and a hash of the files it is rendered from.
+    """
+
+    def __init__(
+        self,
+        languages: LanguageDict = LANGUAGES,
+        lang_features: FeatureDict = LANG_FEATURES,
+        backend: str = "composite",
+        map_directory: FilePath = MAP_DIRECTORY,
+        cache: Optional[RenderCache] = None,
+        mask_directory: FilePath = MASKS_DIRECTORY,
+    ):
+        if backend not in RENDER_BACKENDS:
+            raise ValueError(f"unknown render backend {backend!r}")
+        self.backend = backend
+        self.feature_index = FeatureIndex(languages, lang_features)
+        self.query_engine = QueryEngine(self.feature_index)
+        self.feature_lattice = FeatureLattice.load(self.feature_index)
+        self.mask_layers = find_mask_layers(mask_directory)
+        self.layer_filenames: LayerDict = {}
+        for province in self.feature_index.provinces:
+            if self.mask_layers and province in self.mask_layers.filenames:
+                filename = self.mask_layers.filenames[province]
+            else:
+                filename = layer_filename(province, map_directory)
+            self.layer_filenames[province] = filename
+        self.decode_layer: Decoder = (
+            self.mask_layers.decode if self.mask_layers else decode_layer
+        )
+        self.background: Optional[Image.Image] = None
+        self.compositor: Optional[LayerCompositor] = None
+        self.label_raster: Optional[LabelRaster] = None
+        self.bundle: Optional[AssetBundle] = None
+        self.cache = cache
+        self.source_hash: Optional[str] = None
+        self.lock = threading.RLock()
+        self.index_lock = threading.Lock()
+
+    def load(
+        self,
+        background: Optional[Image.Image] = None,
+        decode: DecodeFunction = decode_now,
+    ) -> None:
+        """
+        Loads the background and the data of the render backend. background
+        may be passed in when the caller has already decoded it; decode lets
+        the caller supply files it decoded ahead of time. The "bundle" backend
+        takes its background from the bundle, rebuilding the bundle first from
+        the masks or layer PNGs if it is missing or its sources have changed.
+        Loading twice does nothing.
+        """
+        with self.lock:
+            if self.background is not None:
+                return
+            if self.backend == "bundle":
+                layer_filenames = (
+                    dict(self.mask_layers.filenames)
+                    if self.mask_layers
+                    else find_layer_filenames()
+                )
+                if not bundle_is_current(layer_filenames):
+                    build_bundle(layer_filenames, decode=self.decode_layer)
+                self.bundle = AssetBundle()
+                self.background = self.bundle.background()
+                return
+            if background is None:
+                background = decode(BACKGROUND_FILENAME, decode_image)
+            if self.backend == "labels":
+                self.label_raster = LabelRaster.load()
+            else:
+                self.compositor = LayerCompositor(background)
+            self.background = background
+
+    def ensure_layers(
+        self, provinces: Iterable[ProvinceName], decode: DecodeFunction = decode_now
+    ) -> None:
+        """
+        Decodes the layers of the given provinces that the compositor does not
+        hold yet. The "labels" and "bundle" backends need no layers.
+        """
+        self.load(decode=decode)
+        with self.lock:
+            if self.compositor is None:
+                return
+            for province in provinces:
+                if province in self.compositor.layers:
+                    continue
+                filename = self.layer_filenames.get(province)
+                if filename is not None:
+                    img, offset = decode(filename, self.decode_layer)
+                    self.compositor.add_layer(province, img, offset)
+
+    def resolve_languages(
+        self,
+        languages: Iterable[LanguageCode] = (),
+        features: Iterable[FeatureName] = (),
+        query: Optional[str] = None,
+    ) -> Mask:
+        """
+        Returns the language mask of a selection: the given languages, plus
+        the languages that have every one of features, plus the languages
+        matching query. Raises QuerySyntaxError for a malformed query and
+        KeyError for unknown languages or features.
+        """
+        with self.index_lock:
+            language_mask = self.feature_index.encode_languages(languages)
+            feature_mask = self.feature_lattice.encode_features(features)
+            if feature_mask:
+                language_mask |= self.feature_lattice.lookup(feature_mask)[0]
+            if query:
+                language_mask |= self.query_engine.evaluate(query)
+        return language_mask
+
+    def resolve(
+        self,
+        languages: Iterable[LanguageCode] = (),
+        features: Iterable[FeatureName] = (),
+        query: Optional[str] = None,
+    ) -> ProvinceSet:
+        """
+        Returns the provinces where the languages of a selection are spoken.
+        """
+        language_mask = self.resolve_languages(languages, features, query)
+        return self.feature_index.decode_provinces(
+            self.feature_index.provinces_for(language_mask)
+        )
+
+    def style(self) -> Style:
+        """
+        Returns the parameters besides the provinces that change the pixels
+        of a map.
+        """
+        return {"backend": self.backend}
+
+    def source_files(self) -> List[FilePath]:
+        """
+        Returns the files the maps of this backend are rendered from.
+        """
+        if self.backend == "labels":
+            return [BACKGROUND_FILENAME, LABELS_FILENAME, LABELS_INDEX_FILENAME]
+        if self.backend == "bundle":
+            return [BUNDLE_FILENAME]
+        if self.mask_layers:
+            return [
+                BACKGROUND_FILENAME,
+                self.mask_layers.index_filename(),
+                *self.layer_filenames.values(),
+            ]
+        return [BACKGROUND_FILENAME, *self.layer_filenames.values()]
+
+    def cache_key(self, provinces: Iterable[ProvinceName]) -> str:
+        """
+        Returns the render cache key of a map, hashing the source files the
+        first time it is needed.
+        """
+        self.load()
+        with self.lock:
+            if self.source_hash is None:
+                self.source_hash = self.cache.source_hash(self.source_files())
+        return self.cache.key(provinces, self.style(), self.source_hash)
+
+    def draw(self, provinces: Set[ProvinceName]) -> Image.Image:
+        """
+        Renders a map without consulting the cache.
+        """
+        self.ensure_layers(provinces)
+        if self.bundle is not None:
+            return self.bundle.render(provinces)
+        if self.label_raster is not None:
+            return self.label_raster.render(self.background, provinces)
+        return self.compositor.render(provinces)
+
+    def render_png(self, provinces: Iterable[ProvinceName]) -> bytes:
+        """
+        Returns the PNG of a map, from the render cache if it holds it.
+        """
+        provinces = set(provinces)
+        if self.cache is None:
+            return encode_png(self.draw(provinces))
+        key = self.cache_key(provinces)
+        png = self.cache.get(key)
+        if png is None:
+            png = encode_png(self.draw(provinces))
+            self.cache.put(key, png)
+        return png
+
+    def render_provinces(self, provinces: Iterable[ProvinceName]) -> Image.Image:
+        """
+        Returns an RGBA image of the background with the provinces highlighted.
+        """
+        provinces = set(provinces)
+        if self.cache is None:
+            return self.draw(provinces)
+        with Image.open(io.BytesIO(self.render_png(provinces))) as img:
+            return img.convert("RGBA")
+
+    def render(
+        self,
+        languages: Iterable[LanguageCode] = (),
+        features: Iterable[FeatureName] = (),
+        query: Optional[str] = None,
+    ) -> Image.Image:
+        """
+        Resolves a selection and renders its provinces.
+        """
+        return self.render_provinces(self.resolve(languages, features, query))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a language map to a PNG")
+    parser.add_argument("output", help="PNG file to write")
+    parser.add_argument(
+        "--language", action="append", default=[], help="language code to show"
+    )
+    parser.add_argument(
+        "--feature",
+        action="append",
+        default=[],
+        help="show the languages that have every given feature",
+    )
+    parser.add_argument("--query", help='feature query, e.g. !"Post-Noun Adj."')
+    parser.add_argument(
+        "--backend",
+        choices=RENDER_BACKENDS,
+        default="composite",
+        help="how provinces are drawn (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--render-cache",
+        default=DEFAULT_RENDER_CACHE_DIR,
+        help="directory of the shared render cache (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-render-cache",
+        action="store_true",
+        help="always render instead of using the render cache",
+    )
+    cli_args = parser.parse_args()
+
+    map_renderer = MapRenderer(
+        backend=cli_args.backend,
+        cache=None if cli_args.no_render_cache else RenderCache(cli_args.render_cache),
+    )
+    provinces = map_renderer.resolve(
+        cli_args.language, cli_args.feature, cli_args.query
+    )
+    with open(cli_args.output, "wb") as f:
+        f.write(map_renderer.render_png(provinces))
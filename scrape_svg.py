@@ -1,56 +1,299 @@
+"""
+Downloads the locator map SVGs from Wikimedia Commons into ./data.
+
+Pages and files are fetched concurrently through one pooled requests session
+with retries. Every response is kept in a local HTTP cache together with its
+ETag and Last-Modified headers, and later runs send conditional requests, so
+files that have not changed on the server cost a 304 instead of a download.
+A summary of requests, cache revalidations, bytes downloaded and bytes saved
+is printed at the end.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote, urljoin
+
 import requests
-from bs4 import BeautifulSoup
-
-links = [
-    "https://commons.wikimedia.org/wiki/File:Hubei_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Guangxi_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Guizhou_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Jiangsu_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Henan_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Beijing_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Liaoning_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Qinghai_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Sichuan_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Xinjiang_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Chongqing_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Jilin_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Tibet_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Guangdong_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Hebei_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Jiangxi_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Shandong_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Ningxia_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Hainan_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Heilongjiang_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Zhejiang_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Tianjin_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Yunnan_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Shanghai_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Gansu_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Anhui_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Fujian_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Hunan_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Shaanxi_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Shanxi_locator_map_(China).svg", 
-    "https://commons.wikimedia.org/wiki/File:Inner_Mongolia_locator_map_(China).svg", 
-]
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-svgs = []
+from asset_files import province_name
+
+
+Url = str
+FilePath = str
+CacheEntry = Dict[str, Optional[str]]
+
+LINKS = [
+    "https://commons.wikimedia.org/wiki/File:Hubei_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Guangxi_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Guizhou_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Jiangsu_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Henan_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Beijing_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Liaoning_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Qinghai_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Sichuan_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Xinjiang_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Chongqing_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Jilin_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Tibet_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Guangdong_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Hebei_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Jiangxi_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Shandong_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Ningxia_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Hainan_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Heilongjiang_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Zhejiang_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Tianjin_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Yunnan_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Shanghai_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Gansu_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Anhui_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Fujian_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Hunan_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Shaanxi_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Shanxi_locator_map_(China).svg",
+    "https://commons.wikimedia.org/wiki/File:Inner_Mongolia_locator_map_(China).svg",
+]
 
-headers = {
+HEADERS = {
     "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36"
 }
+DATA_DIRECTORY = "./data"
+HTTP_CACHE_DIRECTORY = "./data/http_cache"
+HTTP_CACHE_INDEX = "index.json"
+DEFAULT_WORKERS = 8
+DEFAULT_RETRIES = 3
+REQUEST_TIMEOUT = 60
+
+
+class FileLinkParser(HTMLParser):
+    """
+    Finds the href of the first <a class="internal"> on a file description
+    page, which links to the original file.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.href: Optional[str] = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        attributes = dict(attrs)
+        if (
+            self.href is None
+            and tag == "a"
+            and "internal" in (attributes.get("class") or "").split()
+        ):
+            self.href = attributes.get("href")
+
+
+def file_url(page_url: Url, page: bytes) -> Url:
+    """
+    Returns the URL of the original file linked from a file description page.
+    """
+    parser = FileLinkParser()
+    parser.feed(page.decode("utf-8", errors="replace"))
+    if parser.href is None:
+        raise ValueError(f"no file link on {page_url}")
+    return urljoin(page_url, parser.href)
+
+
+def svg_filename(url: Url) -> str:
+    """
+    Returns the name the SVG of a file or file description page is saved
+    under, e.g. Anhui.svg or InnerMongolia.svg.
+    """
+    return province_name(unquote(url.split("/")[-1]).split(":")[-1]) + ".svg"
+
+
+class CachedFetcher:
+    """
+    Fetches URLs concurrently over a pooled session, revalidating cached
+    responses with If-None-Match and If-Modified-Since.
+    """
+
+    def __init__(
+        self,
+        cache_directory: FilePath = HTTP_CACHE_DIRECTORY,
+        workers: int = DEFAULT_WORKERS,
+        retries: int = DEFAULT_RETRIES,
+    ):
+        self.cache_directory = cache_directory
+        self.workers = workers
+        os.makedirs(cache_directory, exist_ok=True)
+        self.index_path = os.path.join(cache_directory, HTTP_CACHE_INDEX)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index: Dict[Url, CacheEntry] = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.index = {}
+
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(
+            pool_connections=workers,
+            pool_maxsize=workers,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+            ),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+
+    def cache_path(self, url: Url) -> FilePath:
+        """
+        Returns where the body of a URL is cached.
+        """
+        return os.path.join(
+            self.cache_directory, hashlib.sha256(url.encode()).hexdigest()
+        )
+
+    def fetch(self, url: Url) -> bytes:
+        """
+        Returns the body of url, from the cache if the server answers 304.
+        """
+        with self.lock:
+            entry = self.index.get(url)
+        headers = {}
+        if entry is not None and os.path.exists(self.cache_path(url)):
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = self.session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304 and headers:
+            with open(self.cache_path(url), "rb") as f:
+                body = f.read()
+            with self.lock:
+                self.requests += 1
+                self.not_modified += 1
+                self.bytes_saved += len(body)
+            return body
+
+        response.raise_for_status()
+        body = response.content
+        temp_path = self.cache_path(url) + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(body)
+        os.replace(temp_path, self.cache_path(url))
+        with self.lock:
+            self.requests += 1
+            self.bytes_downloaded += len(body)
+            self.index[url] = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+        return body
+
+    def fetch_all(self, urls: Iterable[Url]) -> Dict[Url, bytes]:
+        """
+        Fetches urls with at most self.workers requests in flight.
+        """
+        urls = list(urls)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return dict(zip(urls, pool.map(self.fetch, urls)))
+
+    def save_index(self) -> None:
+        """
+        Writes the cache index atomically.
+        """
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=4, sort_keys=True)
+        os.replace(temp_path, self.index_path)
+
+    def summary(self, elapsed: float) -> str:
+        """
+        Describes the requests made so far and how much the cache saved.
+        """
+        megabytes = self.bytes_downloaded / 1e6
+        rate = megabytes / max(elapsed, 1e-9)
+        return (
+            f"{self.requests} requests in {elapsed:.1f} s, "
+            f"{self.not_modified} not modified, "
+            f"{megabytes:.1f} MB downloaded ({rate:.1f} MB/s), "
+            f"{self.bytes_saved / 1e6:.1f} MB saved by the cache"
+        )
+
+
+def scrape(
+    page_urls: List[Url],
+    fetcher: CachedFetcher,
+    output_directory: FilePath = DATA_DIRECTORY,
+) -> List[FilePath]:
+    """
+    Downloads the SVG linked from every file description page into
+    output_directory and returns the paths written.
+    """
+    pages = fetcher.fetch_all(page_urls)
+    svg_urls = [file_url(page_url, page) for page_url, page in pages.items()]
+    svgs = fetcher.fetch_all(svg_urls)
+    os.makedirs(output_directory, exist_ok=True)
+    written = []
+    for svg_url, svg in svgs.items():
+        filepath = os.path.join(output_directory, svg_filename(svg_url))
+        with open(filepath, "wb") as f:
+            f.write(svg)
+        written.append(filepath)
+    return written
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the locator map SVGs")
+    parser.add_argument(
+        "--links",
+        help="file with one file description page URL per line "
+        "(default: the Wikimedia Commons pages in this script)",
+    )
+    parser.add_argument(
+        "--output", default=DATA_DIRECTORY, help="(default: %(default)s)"
+    )
+    parser.add_argument(
+        "--cache", default=HTTP_CACHE_DIRECTORY, help="(default: %(default)s)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="concurrent requests (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="retries of failed requests (default: %(default)s)",
+    )
+    cli_args = parser.parse_args()
 
-for link in links:
-    r = requests.get(link)
-    # print(r.content)
-    soup = BeautifulSoup(r.content, "html.parser")
-    url = soup.find("a", {"class": "internal"}).get("href")
-    print(url)
-    svgs.append(url)
+    if cli_args.links:
+        with open(cli_args.links, "r", encoding="utf-8") as f:
+            page_urls = [line.strip() for line in f if line.strip()]
+    else:
+        page_urls = LINKS
 
-for svg_lnk in svgs:
-    s = requests.get(svg_lnk, headers=headers).text
-    svg_mame = svg_lnk.split("/")[-1].split("_")[0]+".svg"
-    open(f"./data/{svg_mame}", "w").write(s)
\ No newline at end of file
+    fetcher = CachedFetcher(cli_args.cache, cli_args.workers, cli_args.retries)
+    started = time.perf_counter()
+    try:
+        written = scrape(page_urls, fetcher, cli_args.output)
+    finally:
+        fetcher.save_index()
+    print(f"Wrote {len(written)} SVGs to {cli_args.output}")
+    print(fetcher.summary(time.perf_counter() - started))
@@ -0,0 +1,316 @@
+"""
+Local HTTP server that renders map PNGs on demand, built on asyncio streams.
+
+    GET /map.png?language=CMN&feature=Voiced+Consonants&query=...
+    GET /stats
+
+language and feature may be repeated and are combined with query exactly as
+in MapRenderer.resolve. Rendered PNGs are kept in an LRU cache keyed by the
+resolved province set, so every selection covering the same provinces shares
+one entry. Every map carries an ETag derived from its province set and the
+map assets, and a request with a matching If-None-Match is answered with 304
+without rendering anything. Maps missing from memory are taken from the shared
+render cache when it has them. Compositing and PNG encoding run on a thread
+pool so the event loop only parses requests and writes responses.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from lru import LRUCache
+from query import Mask, QuerySyntaxError
+from render_cache import DEFAULT_RENDER_CACHE_DIR, RenderCache
+from renderer import RENDER_BACKENDS, MapRenderer
+
+
+FilePath = str
+Headers = Dict[str, str]
+Response = Tuple[HTTPStatus, Headers, bytes]
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_MAP_CACHE_LIMIT = 64
+MAX_HEADER_LINES = 100
+
+
+def asset_version(filepaths: List[FilePath]) -> str:
+    """
+    Returns a short fingerprint of the size and modification time of the map
+    assets, so ETags change whenever a layer is regenerated.
+    """
+    digest = hashlib.sha1()
+    for filepath in sorted(filepaths):
+        stat = os.stat(filepath)
+        digest.update(f"{filepath}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:12]
+
+
+class MapServer:
+    """
+    Answers map requests with PNGs from a MapRenderer, caching the encoded
+    images and sharing a single render between concurrent identical requests.
+    """
+
+    def __init__(
+        self,
+        map_renderer: MapRenderer,
+        cache_limit: Optional[int] = DEFAULT_MAP_CACHE_LIMIT,
+        workers: Optional[int] = None,
+    ):
+        self.map_renderer = map_renderer
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.cache: LRUCache[Mask, bytes] = LRUCache(cache_limit)
+        self.pending: Dict[Mask, asyncio.Future] = {}
+        self.version: Optional[str] = None
+        self.renders = 0
+        self.not_modified = 0
+
+    def load(self) -> None:
+        """
+        Loads the renderer and fingerprints the files its backend renders
+        from, which are only known once it is loaded.
+        """
+        self.map_renderer.load()
+        self.version = asset_version(self.map_renderer.source_files())
+
+    def etag(self, province_mask: Mask) -> str:
+        """
+        Returns the ETag of the map showing the provinces in province_mask.
+        """
+        backend = self.map_renderer.backend
+        return f'"{backend}-{self.version}-{province_mask:x}"'
+
+    def render_png(self, province_mask: Mask) -> bytes:
+        """
+        Renders and encodes a map. Runs on self.pool.
+        """
+        index = self.map_renderer.feature_index
+        return self.map_renderer.render_png(index.decode_provinces(province_mask))
+
+    async def map_png(self, province_mask: Mask) -> bytes:
+        """
+        Returns the PNG of a province set from the cache, from a render that
+        is already running, or from a new render on the worker pool.
+        """
+        png = self.cache.get(province_mask)
+        if png is not None:
+            return png
+        future = self.pending.get(province_mask)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.pool, self.render_png, province_mask)
+            self.pending[province_mask] = future
+            self.renders += 1
+            try:
+                png = await future
+            finally:
+                del self.pending[province_mask]
+            self.cache.put(province_mask, png)
+            return png
+        return await asyncio.shield(future)
+
+    async def handle_map(
+        self, query: Dict[str, List[str]], headers: Headers
+    ) -> Response:
+        """
+        Resolves the selection in the query string and responds with its map.
+        """
+        try:
+            language_mask = self.map_renderer.resolve_languages(
+                query.get("language", []),
+                query.get("feature", []),
+                " ".join(query.get("query", [])) or None,
+            )
+        except QuerySyntaxError as e:
+            return self.error(HTTPStatus.BAD_REQUEST, f"Invalid query: {e}")
+        except KeyError as e:
+            return self.error(HTTPStatus.BAD_REQUEST, f"Unknown name: {e}")
+
+        province_mask = self.map_renderer.feature_index.provinces_for(language_mask)
+        etag = self.etag(province_mask)
+        cache_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = headers.get("if-none-match", "").replace(" ", "").split(",")
+        if etag in if_none_match or "*" in if_none_match:
+            self.not_modified += 1
+            return HTTPStatus.NOT_MODIFIED, cache_headers, b""
+        png = await self.map_png(province_mask)
+        return HTTPStatus.OK, {**cache_headers, "Content-Type": "image/png"}, png
+
+    def handle_stats(self) -> Response:
+        """
+        Responds with the cache and render counters as JSON.
+        """
+        stats = {
+            "cached_maps": len(self.cache),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "renders": self.renders,
+            "not_modified": self.not_modified,
+        }
+        body = json.dumps(stats).encode()
+        return HTTPStatus.OK, {"Content-Type": "application/json"}, body
+
+    def error(self, status: HTTPStatus, message: str) -> Response:
+        """
+        Returns a plain text error response.
+        """
+        body = f"{status.value} {status.phrase}: {message}\n".encode()
+        return status, {"Content-Type": "text/plain; charset=utf-8"}, body
+
+    async def respond(self, method: str, target: str, headers: Headers) -> Response:
+        """
+        Routes a parsed request to its handler.
+        """
+        if method != "GET":
+            return self.error(HTTPStatus.METHOD_NOT_ALLOWED, "only GET is supported")
+        url = urlsplit(target)
+        if url.path == "/map.png":
+            return await self.handle_map(parse_qs(url.query), headers)
+        if url.path == "/stats":
+            return self.handle_stats()
+        return self.error(HTTPStatus.NOT_FOUND, url.path)
+
+    async def read_headers(self, reader: asyncio.StreamReader) -> Headers:
+        """
+        Reads the header lines of a request up to the blank line that ends
+        them. Raises ValueError for a line longer than the stream limit.
+        """
+        headers: Headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return headers
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Reads one HTTP/1.1 request from a client, writes the response and
+        closes the connection. A request line or header line longer than the
+        stream limit is answered with 414 or 431.
+        """
+        try:
+            request_line: List[str] = []
+            headers: Headers = {}
+            read_error: Optional[Response] = None
+            try:
+                request_line = (await reader.readline()).decode("latin-1").split()
+            except ValueError:
+                read_error = self.error(
+                    HTTPStatus.REQUEST_URI_TOO_LONG, "request line too long"
+                )
+            if read_error is None:
+                try:
+                    headers = await self.read_headers(reader)
+                except ValueError:
+                    read_error = self.error(
+                        HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                        "header line too long",
+                    )
+
+            if read_error is not None:
+                status, response_headers, body = read_error
+            elif len(request_line) != 3:
+                status, response_headers, body = self.error(
+                    HTTPStatus.BAD_REQUEST, "malformed request line"
+                )
+            else:
+                method, target, _ = request_line
+                try:
+                    status, response_headers, body = await self.respond(
+                        method, target, headers
+                    )
+                except Exception as e:
+                    status, response_headers, body = self.error(
+                        HTTPStatus.INTERNAL_SERVER_ERROR, repr(e)
+                    )
+
+            head = [f"HTTP/1.1 {status.value} {status.phrase}"]
+            response_headers = {
+                **response_headers,
+                "Content-Length": str(len(body)),
+                "Connection": "close",
+            }
+            head.extend(f"{name}: {value}" for name, value in response_headers.items())
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        """
+        Loads the renderer and serves requests until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.pool, self.load)
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving maps on http://{host}:{port}/map.png")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP map server")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="(default: %(default)s)")
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT, help="(default: %(default)s)"
+    )
+    parser.add_argument(
+        "--backend",
+        choices=RENDER_BACKENDS,
+        default="composite",
+        help="how provinces are drawn (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-limit",
+        type=int,
+        default=DEFAULT_MAP_CACHE_LIMIT,
+        help="rendered maps kept in memory (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="threads used to render maps (default: Python's thread pool default)",
+    )
+    parser.add_argument(
+        "--render-cache",
+        default=DEFAULT_RENDER_CACHE_DIR,
+        help="directory of the shared render cache (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-render-cache",
+        action="store_true",
+        help="always render instead of using the render cache",
+    )
+    cli_args = parser.parse_args()
+
+    map_server = MapServer(
+        MapRenderer(
+            backend=cli_args.backend,
+            cache=(
+                None if cli_args.no_render_cache else RenderCache(cli_args.render_cache)
+            ),
+        ),
+        cache_limit=cli_args.cache_limit,
+        workers=cli_args.workers,
+    )
+    try:
+        asyncio.run(map_server.serve(cli_args.host, cli_args.port))
+    except KeyboardInterrupt:
+        pass
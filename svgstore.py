@@ -0,0 +1,290 @@
+"""
+Deduplicated storage of the locator map SVGs.
+
+All source SVGs are the same document except for a few attributes, mostly
+the style of the highlighted province. Ingestion stores one base document in
+which every attribute has the value most sources agree on, plus a delta per
+province listing the attributes that differ from the base, keyed by the
+document-order index of their element:
+
+    ./data/compact/base.svg
+    ./data/compact/deltas.json   {"Anhui": {"114": {"style": "fill:#ff8080;..."}}}
+
+A province's SVG is the base streamed through ClassFilter with its delta
+applied, so cleaning the whole set means cleaning base.svg once and dropping
+the delta entries of removed elements. That only holds while every source
+has the same classes, so ingestion rejects sources whose class attributes
+differ.
+
+    python svgstore.py ingest data/cln/*.svg data/cln1/*.svg
+    python svgstore.py clean
+    python svgstore.py extract Anhui Anhui.svg
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import xml.sax
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+from xml.sax.handler import ContentHandler
+from xml.sax.xmlreader import AttributesImpl
+
+import asset_files
+from clean_map_data import (
+    DEFAULT_REMOVED_CLASSES,
+    AttributeOverrides,
+    filter_svg,
+)
+
+
+ProvinceName = str
+FilePath = str
+Attributes = Dict[str, str]
+Deltas = Dict[ProvinceName, AttributeOverrides]
+
+STORE_DIRECTORY = "./data/compact"
+BASE_FILENAME = "base.svg"
+DELTAS_FILENAME = "deltas.json"
+CLEANED_BASE_FILENAME = "base_cleaned.svg"
+CLEANED_DELTAS_FILENAME = "deltas_cleaned.json"
+
+
+class ElementRecorder(ContentHandler):
+    """
+    Records the name and attributes of every element of a document in order,
+    plus a hash of all its character data.
+    """
+
+    def __init__(self):
+        ContentHandler.__init__(self)
+        self.elements: List[Tuple[str, Attributes]] = []
+        self.text = hashlib.sha1()
+
+    def startElement(self, name: str, attrs: AttributesImpl) -> None:
+        self.elements.append((name, dict(attrs.items())))
+
+    def characters(self, content: str) -> None:
+        self.text.update(content.encode())
+
+
+class ElementDiffer(ContentHandler):
+    """
+    Compares a document with a recorded reference element by element and
+    collects the attributes that differ. Raises ValueError as soon as the
+    documents differ in anything but attribute values, or in the class
+    attribute, which decides what cleaning removes: the cleaned store is
+    filtered by the base's classes only.
+    """
+
+    def __init__(self, source: FilePath, reference: ElementRecorder):
+        ContentHandler.__init__(self)
+        self.source = source
+        self.reference = reference
+        self.index = -1
+        self.text = hashlib.sha1()
+        self.changes: AttributeOverrides = {}
+
+    def startElement(self, name: str, attrs: AttributesImpl) -> None:
+        self.index += 1
+        if self.index >= len(self.reference.elements):
+            raise ValueError(f"{self.source} has more elements than the base")
+        reference_name, reference_attrs = self.reference.elements[self.index]
+        if name != reference_name:
+            raise ValueError(
+                f"{self.source}: element {self.index} is <{name}>, "
+                f"not <{reference_name}>"
+            )
+        changes = {}
+        for attr_name in reference_attrs.keys() | set(attrs.getNames()):
+            value = attrs.get(attr_name)
+            if value != reference_attrs.get(attr_name):
+                changes[attr_name] = value
+        if "class" in changes:
+            raise ValueError(
+                f"{self.source}: element {self.index} has a different class "
+                "than in the base"
+            )
+        if changes:
+            self.changes[self.index] = changes
+
+    def characters(self, content: str) -> None:
+        self.text.update(content.encode())
+
+    def endDocument(self) -> None:
+        if self.index + 1 != len(self.reference.elements):
+            raise ValueError(f"{self.source} has fewer elements than the base")
+        if self.text.digest() != self.reference.text.digest():
+            raise ValueError(f"{self.source} differs from the base in its text")
+
+
+def parse(source: FilePath, handler: ContentHandler) -> None:
+    """
+    Runs a SAX handler over a file.
+    """
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(handler)
+    parser.parse(source)
+
+
+def province_name(source: FilePath) -> ProvinceName:
+    """
+    Returns the province an SVG belongs to, taken from its file name.
+    """
+    return asset_files.province_name(os.path.splitext(os.path.basename(source))[0])
+
+
+def build_deltas(
+    sources: List[FilePath],
+) -> Tuple[AttributeOverrides, Deltas]:
+    """
+    Diffs every source against the first one and returns the changes that
+    turn the first source into the base together with every province's
+    delta against that base.
+    """
+    reference = ElementRecorder()
+    parse(sources[0], reference)
+    changes: Dict[FilePath, AttributeOverrides] = {sources[0]: {}}
+    for source in sources[1:]:
+        differ = ElementDiffer(source, reference)
+        parse(source, differ)
+        changes[source] = differ.changes
+
+    def value_in(source: FilePath, index: int, attr_name: str) -> Optional[str]:
+        changed = changes[source].get(index, {})
+        if attr_name in changed:
+            return changed[attr_name]
+        return reference.elements[index][1].get(attr_name)
+
+    varying = sorted(
+        {
+            (i, name)
+            for source_changes in changes.values()
+            for i, c in source_changes.items()
+            for name in c
+        }
+    )
+    base_changes: AttributeOverrides = {}
+    deltas: Deltas = {province_name(source): {} for source in sources}
+    for index, attr_name in varying:
+        values = [value_in(source, index, attr_name) for source in sources]
+        majority = Counter(values).most_common(1)[0][0]
+        if majority != reference.elements[index][1].get(attr_name):
+            base_changes.setdefault(index, {})[attr_name] = majority
+        for source, value in zip(sources, values):
+            if value != majority:
+                deltas[province_name(source)].setdefault(index, {})[attr_name] = value
+    return base_changes, deltas
+
+
+def save_deltas(deltas: Deltas, filename: FilePath) -> None:
+    """
+    Writes deltas as JSON; element indices become string keys.
+    """
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(deltas, f, indent=1, sort_keys=True, ensure_ascii=False)
+
+
+def load_deltas(filename: FilePath) -> Deltas:
+    """
+    Reads deltas written by save_deltas.
+    """
+    with open(filename, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        province: {int(index): attrs for index, attrs in delta.items()}
+        for province, delta in data.items()
+    }
+
+
+def ingest(sources: List[FilePath], directory: FilePath = STORE_DIRECTORY) -> None:
+    """
+    Splits the source SVGs into the base document and per-province deltas.
+    """
+    base_changes, deltas = build_deltas(sorted(sources))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, BASE_FILENAME), "w", encoding="utf-8") as out:
+        filter_svg(sorted(sources)[0], out, (), base_changes)
+    save_deltas(deltas, os.path.join(directory, DELTAS_FILENAME))
+
+
+def clean_store(
+    removed_classes: Iterable[str] = DEFAULT_REMOVED_CLASSES,
+    directory: FilePath = STORE_DIRECTORY,
+) -> None:
+    """
+    Cleans the base document once and carries the deltas over to it, dropping
+    the changes of elements that were removed.
+    """
+    deltas = load_deltas(os.path.join(directory, DELTAS_FILENAME))
+    cleaned_path = os.path.join(directory, CLEANED_BASE_FILENAME)
+    with open(cleaned_path, "w", encoding="utf-8") as out:
+        cleaner = filter_svg(
+            os.path.join(directory, BASE_FILENAME), out, removed_classes
+        )
+    cleaned_deltas = {
+        province: {
+            cleaner.kept[index]: attrs
+            for index, attrs in delta.items()
+            if index in cleaner.kept
+        }
+        for province, delta in deltas.items()
+    }
+    save_deltas(cleaned_deltas, os.path.join(directory, CLEANED_DELTAS_FILENAME))
+
+
+def extract(
+    province: ProvinceName,
+    out: TextIO,
+    cleaned: bool = False,
+    directory: FilePath = STORE_DIRECTORY,
+) -> None:
+    """
+    Writes the SVG of one province, from the cleaned store if cleaned.
+    """
+    base, deltas = (
+        (CLEANED_BASE_FILENAME, CLEANED_DELTAS_FILENAME)
+        if cleaned
+        else (BASE_FILENAME, DELTAS_FILENAME)
+    )
+    delta = load_deltas(os.path.join(directory, deltas))[province]
+    filter_svg(os.path.join(directory, base), out, (), delta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Base plus delta SVG storage")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="build the store from SVGs")
+    ingest_parser.add_argument("sources", nargs="+", help="province SVG files")
+    clean_parser = commands.add_parser("clean", help="clean the stored base once")
+    clean_parser.add_argument(
+        "--remove-class",
+        action="append",
+        dest="removed_classes",
+        help="class of the elements to remove; may be repeated",
+    )
+    extract_parser = commands.add_parser("extract", help="write one province's SVG")
+    extract_parser.add_argument("province")
+    extract_parser.add_argument("output", help="SVG file to write, or - for stdout")
+    extract_parser.add_argument(
+        "--cleaned", action="store_true", help="extract from the cleaned store"
+    )
+    cli_args = parser.parse_args()
+
+    if cli_args.command == "ingest":
+        ingest(cli_args.sources)
+        stored = sum(
+            os.path.getsize(os.path.join(STORE_DIRECTORY, name))
+            for name in (BASE_FILENAME, DELTAS_FILENAME)
+        )
+        original = sum(os.path.getsize(source) for source in cli_args.sources)
+        print(f"Stored {original} bytes of SVG in {stored} bytes")
+    elif cli_args.command == "clean":
+        clean_store(cli_args.removed_classes or DEFAULT_REMOVED_CLASSES)
+    elif cli_args.output == "-":
+        extract(cli_args.province, sys.stdout, cli_args.cleaned)
+    else:
+        with open(cli_args.output, "w", encoding="utf-8") as out:
+            extract(cli_args.province, out, cli_args.cleaned)
@@ -0,0 +1,142 @@
+"""
+Memory regression test for the feature info popup: opening it thousands of
+times must reuse the panel instead of leaking widgets and chart images.
+
+Memory is measured in two passes: the resident set size of the process
+covers the Tcl/Tk widgets and PhotoImage pixel data that a new Toplevel per
+popup would leak, and tracemalloc pins down growth of Python objects more
+precisely. Every popup must also reuse the one panel.
+
+Needs tkinter and a display, and is skipped without them. On a machine
+without one, run it under a virtual X server:
+
+    xvfb-run -a python -m unittest tests.test_feature_info_memory
+"""
+
+import gc
+import os
+import resource
+import sys
+import time
+import tracemalloc
+import unittest
+
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+
+POPUPS = 3000
+WARMUP_POPUPS = 200
+MAX_GROWTH_BYTES = 256 * 1024
+MAX_RSS_GROWTH_BYTES = 8 * 1024 * 1024
+CHART_TIMEOUT_S = 30.0
+
+
+def resident_set_size() -> int:
+    """
+    Returns the current resident set size of the process in bytes, or its
+    peak where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class FeatureInfoMemoryTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            import tkinter as tk
+        except ImportError:
+            self.skipTest("tkinter is not installed")
+        try:
+            tk.Tk().destroy()
+        except tk.TclError:
+            self.skipTest("no display available")
+        self.tk = tk
+
+        import main
+
+        self.previous_directory = os.getcwd()
+        os.chdir(REPO_DIRECTORY)
+        self.app = main.LanguageMapApp(renderer="labels")
+        self.app.withdraw()
+        self.features = sorted(self.app.lang_features)
+
+    def tearDown(self):
+        self.app.destroy()
+        os.chdir(self.previous_directory)
+
+    def toplevels(self):
+        """
+        Returns the Toplevel windows of the application.
+        """
+        return [
+            child
+            for child in self.app.winfo_children()
+            if isinstance(child, self.tk.Toplevel)
+        ]
+
+    def show_popups(self, count):
+        """
+        Opens the popup count times, cycling through the features, lets Tk
+        process each one and checks that every popup reuses the same panel.
+        """
+        panel = self.app.info_panel
+        for i in range(count):
+            self.app.show_feature_info(self.features[i % len(self.features)])
+            self.app.update()
+            if panel is None:
+                panel = self.app.info_panel
+            self.assertIs(self.app.info_panel, panel)
+            self.assertEqual(self.toplevels(), [panel])
+
+    def wait_for_charts(self):
+        """
+        Opens every feature once and waits until its chart is shown, so the
+        chart cache is fully populated before memory is measured.
+        """
+        for feature in self.features:
+            self.app.show_feature_info(feature)
+            deadline = time.monotonic() + CHART_TIMEOUT_S
+            while not self.app.info_panel.chart_future.done():
+                self.assertLess(time.monotonic(), deadline, f"chart of {feature}")
+                self.app.update()
+                time.sleep(0.001)
+            self.app.update()
+
+    def test_repeated_popups_keep_memory_flat(self):
+        self.wait_for_charts()
+        self.show_popups(WARMUP_POPUPS)
+        gc.collect()
+
+        rss_before = resident_set_size()
+        self.show_popups(POPUPS)
+        gc.collect()
+        rss_after = resident_set_size()
+
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            self.show_popups(POPUPS)
+            gc.collect()
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(
+            rss_after - rss_before,
+            MAX_RSS_GROWTH_BYTES,
+            f"{POPUPS} popups grew the resident set by {rss_after - rss_before} bytes",
+        )
+        self.assertLess(
+            after - before,
+            MAX_GROWTH_BYTES,
+            f"{POPUPS} popups grew traced memory by {after - before} bytes",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
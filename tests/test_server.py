@@ -0,0 +1,105 @@
+"""
+End-to-end tests of the map server on localhost: concurrent identical
+requests, conditional requests and malformed requests.
+
+    python -m unittest tests.test_server
+"""
+
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+
+from renderer import MapRenderer  # noqa: E402
+from server import MapServer  # noqa: E402
+
+
+CONCURRENT_CLIENTS = 20
+MAP_TARGET = "/map.png?language=CMN"
+
+
+class MapServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.previous_directory = os.getcwd()
+        os.chdir(REPO_DIRECTORY)
+        self.map_server = MapServer(MapRenderer(backend="labels"))
+        self.map_server.load()
+        self.server = await asyncio.start_server(
+            self.map_server.handle_connection, "127.0.0.1", 0
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.map_server.pool.shutdown()
+        os.chdir(self.previous_directory)
+
+    async def request(self, head: bytes):
+        """
+        Sends a raw request head and returns the status code, the headers
+        and the body of the response.
+        """
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write(head)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        head, _, body = response.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return int(lines[0].split()[1]), headers, body
+
+    async def get(self, target: str, **headers: str):
+        """
+        Sends a GET request for target with the given headers.
+        """
+        lines = [f"GET {target} HTTP/1.1", "Host: localhost"]
+        lines += [
+            f"{name.replace('_', '-')}: {value}" for name, value in headers.items()
+        ]
+        return await self.request(("\r\n".join(lines) + "\r\n\r\n").encode())
+
+    async def test_concurrent_identical_requests_render_once(self):
+        responses = await asyncio.gather(
+            *(self.get(MAP_TARGET) for _ in range(CONCURRENT_CLIENTS))
+        )
+        self.assertEqual({status for status, _, _ in responses}, {200})
+        self.assertEqual(len({body for _, _, body in responses}), 1)
+        self.assertTrue(responses[0][2].startswith(b"\x89PNG"))
+        self.assertEqual(len({headers["etag"] for _, headers, _ in responses}), 1)
+
+        status, _, body = await self.get("/stats")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["renders"], 1)
+
+    async def test_matching_etag_is_not_modified(self):
+        _, headers, _ = await self.get(MAP_TARGET)
+        status, _, body = await self.get(MAP_TARGET, If_None_Match=headers["etag"])
+        self.assertEqual(status, 304)
+        self.assertEqual(body, b"")
+
+    async def test_invalid_selections_are_bad_requests(self):
+        status, _, _ = await self.get("/map.png?query=%22Post-Noun")
+        self.assertEqual(status, 400)
+        status, _, _ = await self.get("/map.png?language=NOT-A-LANGUAGE")
+        self.assertEqual(status, 400)
+
+    async def test_over_long_lines_are_rejected(self):
+        status, _, _ = await self.get("/map.png?language=" + "A" * 100_000)
+        self.assertEqual(status, 414)
+        status, _, _ = await self.get(MAP_TARGET, X_Padding="A" * 100_000)
+        self.assertEqual(status, 431)
+
+
+if __name__ == "__main__":
+    unittest.main()